@@ -0,0 +1,433 @@
+"""
+Benchmark the build.py script that site_builder.py generates. Synthetic
+projects of the requested sizes are scaffolded with site_builder.py and filled
+with views, images, fonts, static files and sass, then built with stand-ins for
+inkscape, convert and sass that only sleep and write placeholder output. Every
+download is served from a local mirror, so no network access is needed.
+
+Each project is built cold (no previous build and an empty cache), warm (with
+nothing changed) and after editing a single view, sass partial or image. For
+every build the wall and cpu time, peak resident memory, the files written and
+removed in www, and the counters of build.py --profile are reported.
+
+Requirements:
+    - Python 3.x
+    - Linux (peak memory is read with wait4)
+
+Copyright (c) 2015, Nick Balboni.
+License: BSD (see LICENSE for details)
+"""
+
+
+
+################################################################################
+##### Command Line Interface ###################################################
+################################################################################
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+import os
+
+parser = ArgumentParser(
+    formatter_class=ArgumentDefaultsHelpFormatter,
+    description=__doc__ )
+parser.add_argument("-s", "--sizes",
+    type=int,
+    nargs='+',
+    default=[ 10, 100, 1000 ],
+    help="number of views, and of assets, in each synthetic project." )
+parser.add_argument("-l", "--latency",
+    type=str,
+    nargs='+',
+    default=[ "0.05" ],
+    help="seconds each stub tool sleeps per call, either for all of them or "
+    "for one as TOOL=SECONDS (i.e. 0.05 inkscape=0.2)." )
+parser.add_argument("-b", "--build-args",
+    type=str,
+    default="-d",
+    help="arguments given to build.py for every build, quote them and use an "
+    "equals sign (i.e. -b='-d -s -j 4'). Builds are kept out of --watch and "
+    "dev mode since those never exit." )
+parser.add_argument("-r", "--repeat",
+    type=int,
+    default=3,
+    help="number of times each scenario is run, the median is reported." )
+parser.add_argument("--seed",
+    type=int,
+    default=0,
+    help="seed for the synthetic project contents." )
+parser.add_argument("-w", "--workdir",
+    type=str,
+    help="directory for the projects, stub tools and cache. A temporary "
+    "directory that is removed afterwards is used if not given." )
+parser.add_argument("-o", "--output",
+    type=str,
+    help="write every measurement to this json file." )
+args = parser.parse_args()
+
+
+
+################################################################################
+##### Templates ################################################################
+################################################################################
+
+from string import Template
+import sys
+
+STUB_TOOL_TEMPLATE = Template("""\
+#!${python}
+# stand-in for ${tool} written by benchmark.py, sleeps instead of working
+import os, sys, time
+
+args = sys.argv[1:]
+if "--version" in args:
+    print("${version}")
+    sys.exit(0)
+time.sleep(${latency})
+${body}""" )
+
+
+INKSCAPE_BODY = """\
+output, size = None, 16
+for i, arg in enumerate(args):
+    if arg in ("-o", "-e", "--export-png", "--export-filename"):
+        output = args[i + 1]
+    elif arg.startswith(("--export-png=", "--export-filename=")):
+        output = arg.split("=", 1)[1]
+    elif arg in ("-w", "--export-width"):
+        size = int(args[i + 1])
+with open(output, 'wb') as f: # roughly the size of a real render
+    f.write(b"\\x89PNG\\r\\n\\x1a\\n" + b"\\0" * (size * size // 4))
+"""
+
+
+CONVERT_BODY = """\
+with open(args[-1], 'wb') as f: # options are skipped, the inputs joined up
+    for image in [ a for a in args[:-1] if os.path.isfile(a) ]:
+        with open(image, 'rb') as i:
+            f.write(i.read())
+"""
+
+
+SASS_BODY = """\
+def compile(source, output):
+    with open(source, 'r') as f:
+        css = " ".join( l.strip() for l in f if not l.startswith("@import") )
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        f.write(css)
+
+pairs = [ a.split(":", 1) for a in args if ":" in a and not a.startswith("-") ]
+paths = [ a for i, a in enumerate(args) if not a.startswith("-") and
+          ":" not in a and args[i - 1] not in ("-t", "--style") ]
+for source, output in pairs or [ paths[:2] ]:
+    compile(source, output)
+if "--watch" in args: # stays up like the real thing until it is killed
+    while True: time.sleep(60)
+"""
+
+
+STUB_BOTTLE = """\
+# stand-in for bottle.py written by benchmark.py, enough for build.py -s
+import os
+
+TEMPLATES = {}
+request = None
+
+class BaseTemplate:
+    defaults = {}
+
+def template(name, **kwargs):
+    with open(os.path.join("views", name + ".tpl"), 'r') as f:
+        return f.read()
+"""
+
+
+FAVICON_SVG = """\
+<svg xmlns="http://www.w3.org/2000/svg" width="64" height="64">
+  <rect width="64" height="64" fill="#2a7ae2"/>
+</svg>
+"""
+
+
+VIEW_TEMPLATE = Template("""\
+<!DOCTYPE html>
+<html lang="en">
+% include('~head.tpl', title='$title', description='$title')
+    <body>
+        <h1>$title</h1>
+$paragraphs
+    </body>
+</html>
+""" )
+
+
+STYLESHEET_TEMPLATE = Template("""\
+@import "all";
+
+body.$name { margin: $margin; }
+""" )
+
+
+SASS_TEMPLATE = Template("""\
+.$name {
+    margin: ${margin}px;
+    padding: ${padding}px;
+    color: #$color; }
+""" )
+
+
+MIRRORED_URLS = [ # everything site_builder.py and build.py download
+    "https://raw.githubusercontent.com/bottlepy/bottle/master/bottle.py",
+    "https://raw.githubusercontent.com/"
+        "mastastealth/sass-flex-mixin/master/_flexbox.scss",
+    "https://raw.githubusercontent.com/"
+        "paranoida/sass-mediaqueries/master/_media-queries.scss",
+    "https://raw.githubusercontent.com/"
+        "SwankSwashbucklers/some-sassy-mixins/master/mixins.scss" ]
+
+
+
+################################################################################
+##### Synthetic Projects #######################################################
+################################################################################
+
+from subprocess import Popen, check_call, DEVNULL, STDOUT
+from os.path import join, isdir, isfile, dirname, abspath, relpath
+from shutil import rmtree
+from random import Random
+from time import perf_counter, time_ns
+import json, shlex, statistics
+
+SCRIPT_DIR   = dirname(abspath(__file__))
+WORDS        = ( "lorem ipsum dolor sit amet consectetur adipiscing elit sed "
+                 "do eiusmod tempor incididunt ut labore et dolore magna "
+                 "aliqua enim ad minim veniam quis nostrud" ).split()
+TOOL_VERSION = { "inkscape": "Inkscape 1.0 (benchmark stub)",
+                 "convert": "Version: ImageMagick 6.9 (benchmark stub)",
+                 "sass": "Ruby Sass 3.4 (benchmark stub)" }
+TOOL_BODY    = { "inkscape": INKSCAPE_BODY, "convert": CONVERT_BODY,
+                 "sass": SASS_BODY }
+
+
+def write_file(filepath, data):
+    if not isdir(dirname(filepath)): os.makedirs(dirname(filepath))
+    with open(filepath, 'wb' if isinstance(data, bytes) else 'w') as f:
+        f.write(data)
+
+
+def text(random, words):
+    return " ".join( random.choice(WORDS) for _ in range(words) )
+
+
+def setup_environment(workdir):
+    """ write the stub tools and mirror, and the environment that uses them """
+    latency = { "*": 0.0 }
+    for item in args.latency:
+        tool, _, seconds = item.rpartition("=")
+        latency[tool or "*"] = float(seconds)
+    for tool, body in TOOL_BODY.items():
+        filepath = join(workdir, "bin", tool)
+        write_file(filepath, STUB_TOOL_TEMPLATE.substitute( tool=tool,
+            python=sys.executable, version=TOOL_VERSION[tool], body=body,
+            latency=latency.get(tool, latency["*"]) ))
+        os.chmod(filepath, 0o755)
+    if not isfile(join(workdir, "bin", "python")): # the scripts call python
+        os.symlink(sys.executable, join(workdir, "bin", "python"))
+
+    mirror = join(workdir, "mirror")
+    for url in MIRRORED_URLS:
+        write_file( join(mirror, url.split("://", 1)[1].split("/", 1)[1]),
+            STUB_BOTTLE if url.endswith(".py") else "@mixin stub() { }\n" )
+    environment = dict(os.environ)
+    environment.pop("WEBSITR_OFFLINE", None)
+    environment.update(
+        PATH=os.pathsep.join([ join(workdir, "bin"), os.environ["PATH"] ]),
+        WEBSITR_CACHE=join(workdir, "cache"),
+        WEBSITR_MIRRORS="https://raw.githubusercontent.com/=file://{}/".format(
+            mirror ) )
+    return environment
+
+
+def generate_project(workdir, size, environment):
+    """ scaffold a project with site_builder.py, then add size views and
+        size assets split between images, static files and fonts """
+    name, random = "bench-{}".format(size), Random(args.seed + size)
+    project = join(workdir, name)
+    if not isfile(join(workdir, "favicon.svg")):
+        write_file(join(workdir, "favicon.svg"), FAVICON_SVG)
+    check_call( [ sys.executable, join(SCRIPT_DIR, "site_builder.py"), name,
+                  "-p", workdir, "-f", join(workdir, "favicon.svg") ],
+                cwd=workdir, stdout=DEVNULL, env=environment )
+
+    for i in range(1, size): # index.tpl is already there
+        write_file( join(project, "dev/views", "page-{:05d}.tpl".format(i)),
+            VIEW_TEMPLATE.substitute( title="Page {}".format(i),
+                paragraphs="\n".join( "        <p>{}</p>".format(
+                    text(random, random.randint(20, 120)) )
+                    for _ in range(random.randint(1, 6)) ) ) )
+    for i in range(size):
+        if i % 10 < 5:
+            n = random.randint(512, 8192)
+            write_file( join(project, "res/img", "image-{:05d}.png".format(i)),
+                random.getrandbits(n * 8).to_bytes(n, 'little') )
+        elif i % 10 < 9:
+            extension = random.choice([ ".txt", ".js", ".json", ".xml" ])
+            write_file( join(project, "res/static",
+                             "file-{:05d}{}".format(i, extension)),
+                text(random, random.randint(50, 2000)) )
+        else:
+            n = random.randint(4096, 32768)
+            write_file( join(project, "res/font", "font-{:05d}.woff".format(i)),
+                random.getrandbits(n * 8).to_bytes(n, 'little') )
+
+    sass = lambda name: SASS_TEMPLATE.substitute( name=name,
+        margin=random.randint(0, 32), padding=random.randint(0, 32),
+        color="{:06x}".format(random.getrandbits(24)) )
+    for i in range(max(1, size // 20)):
+        for kind in [ "partials", "modules" ]:
+            write_file( join(project, "dev/sass", kind,
+                             "_{}-{:04d}.scss".format(kind[:-1], i)),
+                sass("{}-{}".format(kind[:-1], i)) )
+    for i in range(max(1, size // 200)):
+        write_file( join(project, "dev/sass", "page-{:03d}.scss".format(i)),
+            STYLESHEET_TEMPLATE.substitute( name="page-{}".format(i),
+                                            margin=random.randint(0, 32) ) )
+    return project
+
+
+def edit_file(project, kind, revision):
+    """ change one input of the kind given, the way an editor would """
+    filepath = join(project, {
+        "view": "dev/views/index.tpl",
+        "sass": "dev/sass/partials/_partial-0000.scss",
+        "image": "res/img/image-00000.png" }[kind])
+    if kind == "image":
+        with open(filepath, 'ab') as f:
+            f.write(bytes([ revision % 256 ]))
+    else:
+        with open(filepath, 'a') as f:
+            f.write("\n// {}\n".format(revision) if kind == "sass" else
+                    "<!-- {} -->\n".format(revision))
+
+
+
+################################################################################
+##### Measurements #############################################################
+################################################################################
+
+def snapshot(directory):
+    """ modification time of every file under directory, to count what a build
+        wrote, whether in place or in a deployment build swapped in for it """
+    files = {}
+    for root, dirs, filenames in os.walk(directory):
+        for filename in filenames:
+            files[relpath(join(root, filename), directory)] = \
+                os.lstat(join(root, filename)).st_mtime_ns
+    return files
+
+
+def run_build(project, output, scenario, environment):
+    """ run build.py once, returning its measurements """
+    www, profile = join(output, "www"), join(output, "profile.json")
+    before = snapshot(www)
+    command = [ sys.executable, "build.py", "-p", output, "--profile",
+                profile ] + shlex.split(args.build_args)
+    if scenario == "cold": command.append("-c")
+    with open(join(output, "build.log"), 'w') as log:
+        begin, started = perf_counter(), time_ns()
+        process = Popen( command, cwd=project, env=environment,
+                         stdout=log, stderr=STDOUT )
+        # wait4 reports the peak memory of build.py and the tools it ran
+        pid, status, usage = os.wait4(process.pid, 0)
+        wall = perf_counter() - begin
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise Exception("build.py failed during the {} build, see {}".format(
+            scenario, join(output, "build.log") ))
+    after = snapshot(www)
+    with open(profile, 'r') as f:
+        report = json.load(f)
+    return {
+        "scenario": scenario,
+        "wall": round(wall, 4),
+        "cpu": round(usage.ru_utime + usage.ru_stime, 4),
+        "peak_rss_kib": usage.ru_maxrss, # kibibytes on linux
+        "files_written": sum( 1 for f, m in after.items() if m >= started ),
+        "files_removed": sum( 1 for f in before if f not in after ),
+        "files_unchanged": sum( 1 for f, m in after.items() if m < started ),
+        "tool_calls": { t: c["calls"] for t, c in report["commands"].items() },
+        "stages": report["stages"],
+        "counters": report["counters"] }
+
+
+def benchmark(workdir, size, environment):
+    print("Generating project with {0} views and {0} assets".format(size))
+    begin = perf_counter()
+    project = generate_project(workdir, size, environment)
+    print("  generated in {:.2f}s".format(perf_counter() - begin))
+    output = join(workdir, "out-{}".format(size))
+    if not isdir(output): os.makedirs(output)
+    runs = []
+    for revision in range(args.repeat):
+        if isdir(environment["WEBSITR_CACHE"]): # cold means no favicons either
+            rmtree(environment["WEBSITR_CACHE"])
+        runs.append(run_build(project, output, "cold", environment))
+        runs.append(run_build(project, output, "warm", environment))
+        for kind in [ "view", "sass", "image" ]:
+            edit_file(project, kind, revision)
+            runs.append(run_build(project, output, "edit " + kind, environment))
+    for run in runs: run["size"] = size
+    return runs
+
+
+def summarize(runs):
+    row = "{:>6} {:<11}" + " {:>8}" * 9
+    print(row.format( "size", "scenario", "wall s", "cpu s", "rss MiB",
+        "written", "removed", "copied", "linked", "reused", "tools" ))
+    scenarios = []
+    for run in runs:
+        if (run["size"], run["scenario"]) not in scenarios:
+            scenarios.append((run["size"], run["scenario"]))
+    for size, scenario in scenarios:
+        same = [ r for r in runs
+                 if r["size"] == size and r["scenario"] == scenario ]
+        median = lambda f: statistics.median( f(r) for r in same )
+        print(row.format( size, scenario,
+            "{:.3f}".format(median(lambda r: r["wall"])),
+            "{:.3f}".format(median(lambda r: r["cpu"])),
+            "{:.1f}".format(max( r["peak_rss_kib"] for r in same ) / 1024),
+            median(lambda r: r["files_written"]),
+            median(lambda r: r["files_removed"]),
+            median(lambda r: r["counters"].get("files copied", 0)),
+            median(lambda r: r["counters"].get("files linked", 0)),
+            median(lambda r: r["counters"].get("files reused", 0)),
+            median(lambda r: sum(r["tool_calls"].values())) ))
+
+
+
+################################################################################
+##### Script Body ##############################################################
+################################################################################
+
+from tempfile import mkdtemp
+
+if not hasattr(os, "wait4"):
+    sys.exit("The benchmark needs wait4 to measure memory, run it on Linux")
+
+workdir = abspath(args.workdir) if args.workdir else mkdtemp(prefix="websitr-")
+try:
+    if not isdir(workdir): os.makedirs(workdir)
+    environment = setup_environment(workdir)
+    runs = []
+    for size in args.sizes:
+        runs += benchmark(workdir, size, environment)
+    print("")
+    summarize(runs)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({ "build_args": args.build_args, "latency": args.latency,
+                        "repeat": args.repeat, "seed": args.seed,
+                        "runs": runs }, f, indent=1)
+finally:
+    if not args.workdir: rmtree(workdir, ignore_errors=True)
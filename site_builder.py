@@ -8,6 +8,8 @@ nginx reverse proxy.
 Requirements:
     - Python 3.x
     - CoffeeScript
+    - TypeScript
+    - Terser (optional, minifies the javascript bundles)
     - Sass
     - Git
     - Inkscape
@@ -51,7 +53,17 @@ parser.add_argument("-r", "--resources",
     help="locations of any additional resources to be added to the project. If "
     "an absolute path is not given, location will be assumed to be relative to "
     "the location of this script." )
-args = parser.parse_args()
+parser.add_argument("-j", "--jobs",
+    type=int,
+    default=os.cpu_count() or 1,
+    help="maximum number of resources to import at once." )
+parser.add_argument("--profile", 
+    type=str,
+    nargs='?',
+    const="profile.json",
+    help="time each step of the script and every external command it runs, "
+    "and write the results to the given json file along with a chrome "
+    "trace-event file (*.trace.json) that can be loaded in chrome://tracing" )
 
 
 
@@ -70,82 +82,300 @@ class TemplateWrapper():
         HTML_LL   = 120
 
         self.cls = cls
-        self.headers = [
-            (   # Primary python file header template
-                compile(r'\$ph{(.*?)}'),
-                lambda x: "\\n\\n{1}\\n##### {0} {2}\\n{1}\\n".format(
-                    x.upper(), '#'*PYTHON_LL, '#'*(PYTHON_LL-len(x)-7) )
-            ),
-            (   # Secondary python file header template
-                compile(r'\$sh{(.*?)}'),
-                lambda x: "\\n### {0} {1}".format(
-                    x, '#'*(PYTHON_LL-len(x)-5) )
-            ),
-            (   # HTML file header template
-                compile(r'\$wh{(.*?)}'),
-                lambda x: "<!-- ***** {0} {1} -->".format(
+        self.cache = {}
+        self.header = compile(r'\\$(ph|sh|wh){(.*?)}')
+        self.headers = {
+            # Primary python file header template
+            "ph": lambda x: "\\n\\n{1}\\n##### {0} {2}\\n{1}\\n".format(
+                    x.upper(), '#'*PYTHON_LL, '#'*(PYTHON_LL-len(x)-7) ),
+            # Secondary python file header template
+            "sh": lambda x: "\\n### {0} {1}".format(
+                    x, '#'*(PYTHON_LL-len(x)-5) ),
+            # HTML file header template
+            "wh": lambda x: "<!-- ***** {0} {1} -->".format(
                     x, '*'*(HTML_LL-len(x)-16) )
-            )
-        ]
+        }
         
     def __call__(self, template):
-        for header in self.headers:
-            ptn, tpl = header
-            for match in ptn.finditer(template):
-                replacements = ( match.group(0), tpl(match.group(1)) )
-                template = template.replace(*replacements)
-        template_obj = self.cls(template)
-        template_obj.populate = self.populate
-        return template_obj
+        if template not in self.cache:
+            expanded = self.header.sub(
+                lambda m: self.headers[m.group(1)](m.group(2)), template )
+            template_obj = self.cls(expanded)
+            template_obj.segments = self.compile(expanded)
+            template_obj.populate = self.populate
+            self.cache[template] = template_obj
+        return self.cache[template]
+
+    def compile(self, template):
+        # split into (text, placeholder name, placeholder) parts, so templates
+        # are only parsed once however many times they are populated
+        segments, position = [], 0
+        for match in self.cls.pattern.finditer(template):
+            text = template[position:match.start()]
+            if match.group('escaped') is not None:
+                segments.append(( text + self.cls.delimiter, None, "" ))
+            else:
+                segments.append(( text, match.group('named') or 
+                                  match.group('braced'), match.group(0) ))
+            position = match.end()
+        segments.append(( template[position:], None, "" ))
+        return segments
+
+    @staticmethod
+    def write(f, template, mapping):
+        for text, name, placeholder in template.segments:
+            f.write(text)
+            if name not in mapping: # same as safe_substitute
+                f.write(placeholder)
+            elif isinstance(mapping[name], list):
+                for i, (tpl, values) in enumerate(mapping[name]):
+                    if i: f.write("\\n")
+                    TemplateWrapper.write(f, tpl, values)
+            else:
+                f.write(str(mapping[name]))
 
     @staticmethod
     def populate(template, filepath, **kwargs):
-        for key, value in kwargs.items():
-            if isinstance(value, list):
-                kwargs[key] = "\\n".join(
-                    [ t[0].safe_substitute(**t[1]) for t in value ]
-                )
-        try:
-            with open(filepath, 'w') as f:
-                f.write(template.safe_substitute(**kwargs))
-        except Exception as exception:
-            raise exception
+        with open(filepath, 'w') as f: # lists of templates are streamed out
+            TemplateWrapper.write(f, template, kwargs)
 
 Template = TemplateWrapper(Template)
 
 
 from subprocess import Popen, call, DEVNULL, STDOUT, PIPE
 from sys import executable
+import os
+
+from contextlib import contextmanager
+from threading import Lock, get_ident
+from time import perf_counter
+import json
+
+class Profiler():
+    \"""
+    Collects the time spent in each stage of a script and in each external 
+    command it runs, along with counters (i.e. files and bytes copied), and 
+    writes them out as a json report and a chrome trace-event file.
+    \"""
+
+    def __init__(self):
+        self.enabled, self.lock, self.origin = False, Lock(), perf_counter()
+        self.events, self.counters, self.threads, self.current = [], {}, {}, None
+        self.critical_path = [] # (task, seconds) of the longest chain, if any
+
+    def add(self, name, category, begin, end, details):
+        with self.lock:
+            tid = self.threads.setdefault(get_ident(), len(self.threads))
+            self.events.append({ "name": name, "cat": category, "ph": "X", 
+                "ts": (begin - self.origin) * 1e6, "dur": (end - begin) * 1e6, 
+                "pid": os.getpid(), "tid": tid, "args": details })
+
+    @contextmanager
+    def stage(self, name, category="stage", **details):
+        begin = perf_counter()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                self.add(name, category, begin, perf_counter(), details)
+
+    def call(self, name, function, *args):
+        with self.stage(name):
+            return function(*args)
+
+    def step(self, name=None):
+        # for straight line scripts, ends the last step and starts the next
+        if self.current and self.enabled:
+            self.add(self.current[0], "stage", self.current[1], 
+                     perf_counter(), {})
+        self.current = (name, perf_counter()) if name else None
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def save(self, filepath):
+        self.step()
+        summary = lambda c: { e["name"]: round(sum( f["dur"] for f in 
+            self.events if f["cat"] == c and f["name"] == e["name"] ) / 1e6, 
+            4) for e in self.events if e["cat"] == c }
+        commands = {}
+        for e in self.events:
+            if e["cat"] == "command":
+                entry = commands.setdefault(e["name"], { "calls": 0, 
+                                                         "seconds": 0 })
+                entry["calls"] += 1
+                entry["seconds"] = round(entry["seconds"] + e["dur"] / 1e6, 4)
+        with open(filepath, 'w') as f:
+            json.dump({ "seconds": round(perf_counter() - self.origin, 4), 
+                        "stages": summary("stage"), "commands": commands, 
+                        "counters": self.counters, 
+                        "critical path": self.critical_path }, f, indent=1)
+        end = (perf_counter() - self.origin) * 1e6
+        with open(os.path.splitext(filepath)[0] + ".trace.json", 'w') as f:
+            json.dump({ "displayTimeUnit": "ms", "traceEvents": self.events + 
+                [ { "name": n, "ph": "C", "ts": end, "pid": os.getpid(), 
+                    "args": { n: v } } for n, v in self.counters.items() ] }, f)
+
+PROFILER = Profiler()
+
 
 def sPopen(*args):
-    command, shell = list(args), True
+    command, shell = list(args), os.name == 'nt'
     if command[0] == 'python': 
         command[0] = executable
         shell = False
-    if os.name == 'nt':
-        from subprocess import CREATE_NEW_CONSOLE
-        Popen( command, shell=shell, creationflags=CREATE_NEW_CONSOLE )
-    else:
-        Popen( command, shell=shell )
+    with PROFILER.stage(" ".join(args[:2]) if args[0] == 'python' else args[0],
+                        "command", command=command):
+        if os.name == 'nt':
+            from subprocess import CREATE_NEW_CONSOLE
+            return Popen( command, shell=shell, 
+                          creationflags=CREATE_NEW_CONSOLE )
+        else:
+            return Popen( command, shell=shell )
 
 def sCall(*args):
-    command, shell = list(args), True
+    command, shell = list(args), os.name == 'nt'
     if command[0] == 'python': 
         command[0] = executable
         shell = False
-    call( command, shell=shell, stdout=DEVNULL, stderr=STDOUT )
+    with PROFILER.stage(" ".join(args[:2]) if args[0] == 'python' else args[0],
+                        "command", command=command):
+        return call( command, shell=shell, stdout=DEVNULL, stderr=STDOUT )
+
+
+from shutil import rmtree
+from threading import Thread
+import ctypes, ctypes.util
+
+def replace_directory(source, destination, retired):
+    \"""
+    Move the source directory to destination, and the directory that was there 
+    to retired. Linux swaps the two in one atomic rename, elsewhere nothing is 
+    at destination for the moment between two renames.
+    \"""
+    if not os.path.isdir(destination):
+        return os.rename(source, destination)
+    try: # renameat2(AT_FDCWD, source, AT_FDCWD, destination, RENAME_EXCHANGE)
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        exchanged = libc.renameat2( -100, os.fsencode(source), 
+                                    -100, os.fsencode(destination), 2 ) == 0
+    except (OSError, AttributeError, TypeError):
+        exchanged = False
+    if exchanged:
+        os.rename(source, retired)
+    else:
+        os.rename(destination, retired)
+        os.rename(source, destination)
+
+def remove_in_background(*paths):
+    \"""
+    Remove the paths on a thread while the caller gets on with its work. It 
+    is not a daemon thread, so a script that returns first waits for it to 
+    finish before exiting, rather than leaving half removed directories.
+    \"""
+    thread = Thread(target=lambda: [ rmtree(p, True) for p in paths ])
+    thread.start()
+    return thread
 """
 
-with open('overrides.py', 'w') as f:
-    f.write(OVERRIDES)
+from types import ModuleType
 
-from overrides import sPopen, sCall
-from overrides import TemplateWrapper
+def load_module(name, source):
+    """ load python source kept in a string as a module, without a file """
+    module = ModuleType(name)
+    exec(compile(source, "<{}>".format(name), "exec"), module.__dict__)
+    return module
+
+overrides = load_module("overrides", OVERRIDES)
 from string import Template
+Profiler = overrides.Profiler
+replace_directory = overrides.replace_directory
+remove_in_background = overrides.remove_in_background
+TemplateWrapper = overrides.TemplateWrapper
 
 Template = TemplateWrapper(Template)
 
 
+DOWNLOADS = """\
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+from tempfile import NamedTemporaryFile
+from hashlib import sha1, sha256
+from shutil import copyfile
+import json, os
+
+DOWNLOAD_CACHE = os.path.join( os.environ.get("WEBSITR_CACHE", 
+    os.path.join(os.path.expanduser("~"), ".cache", "websitr") ), "downloads" )
+MIRRORS = [ m.split("=", 1) for m in # i.e. "https://a.com/=https://b.com/a/"
+            os.environ.get("WEBSITR_MIRRORS", "").split(",") if "=" in m ]
+
+def write_atomic(filepath, data):
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with NamedTemporaryFile(dir=os.path.dirname(filepath), delete=False) as f:
+        f.write(data)
+    os.replace(f.name, filepath)
+
+def fetch(url, destination, offline=None, timeout=30):
+    \"""
+    Copy the resource at url to destination through a content addressed cache 
+    shared by every project. Cached copies are revalidated with the ETag and 
+    Last-Modified date they were served with, mirror urls are tried before the 
+    url itself, and the cached copy is used when offline or nothing answers.
+    \"""
+    if offline is None: offline = bool(os.environ.get("WEBSITR_OFFLINE"))
+    entry_path = os.path.join(DOWNLOAD_CACHE, 
+                              sha1(url.encode()).hexdigest() + ".json")
+    entry, errors = {}, []
+    if os.path.isfile(entry_path):
+        with open(entry_path, 'r') as f:
+            entry = json.load(f)
+    cached = os.path.join(DOWNLOAD_CACHE, "objects", entry.get("digest", "-"))
+    have = os.path.isfile(cached)
+
+    sources = [] if offline else \\
+        [ url.replace(a, b, 1) for a, b in MIRRORS if url.startswith(a) ] + [url]
+    for source in sources:
+        headers = {}
+        if have and entry.get("source") == source:
+            if entry.get("etag"): headers["If-None-Match"] = entry["etag"]
+            if entry.get("modified"): 
+                headers["If-Modified-Since"] = entry["modified"]
+        try:
+            with urlopen(Request(source, headers=headers), 
+                         timeout=timeout) as response:
+                data = response.read()
+                etag = response.headers.get("ETag")
+                modified = response.headers.get("Last-Modified")
+        except HTTPError as error:
+            if error.code == 304: break # cached copy is still current
+            errors.append(error)
+            continue
+        except OSError as error:
+            errors.append(error)
+            continue
+        digest = sha256(data).hexdigest()
+        cached = os.path.join(DOWNLOAD_CACHE, "objects", digest)
+        if not os.path.isfile(cached): write_atomic(cached, data)
+        entry = { "url": url, "source": source, "digest": digest, 
+                  "etag": etag, "modified": modified }
+        write_atomic(entry_path, json.dumps(entry).encode())
+        have = True
+        break
+    else:
+        if have and sources:
+            print("Using cached copy of {}".format(url))
+
+    if not have:
+        raise OSError("Could not fetch {} ({})".format( url, 
+            errors or "not cached, can not be fetched offline" ))
+    copyfile(cached, destination)
+"""
+
+downloads = load_module("downloads", DOWNLOADS)
+
+
 
 ################################################################################
 ##### Templates ################################################################
@@ -174,39 +404,39 @@ STYLES_SASS_TEMPLATE = Template("""\
 """ )
 
 
-UPDATE_SASS_TEMPLATE = Template("""\
-from urllib.request import urlopen
-from shutil import copyfileobj
-import os
+SASS_RESOURCES = [ # vendor sass files, (name, url)
+    ( "_flex-box_mixins.scss", "https://raw.githubusercontent.com/"
+      "mastastealth/sass-flex-mixin/master/_flexbox.scss" ),
+    ( "_media-query_mixins.scss", "https://raw.githubusercontent.com/"
+      "paranoida/sass-mediaqueries/master/_media-queries.scss" ),
+    ( "_general_mixins.scss", "https://raw.githubusercontent.com/"
+      "SwankSwashbucklers/some-sassy-mixins/master/mixins.scss" ) ]
 
 
-RESOURCES = (
-[ 
+SASS_RESOURCE_TEMPLATE = Template("""\
     { 
-        "name": "_flex-box_mixins.scss",
-        "url":( "https://raw.githubusercontent.com/"
-                "mastastealth/sass-flex-mixin/master/_flexbox.scss" ) 
+        "name": "${name}",
+        "url":( "${host}"
+                "${path}" ) 
     },
+""" )
 
-    { 
-        "name": "_media-query_mixins.scss",
-        "url":( "https://raw.githubusercontent.com/"
-                "paranoida/sass-mediaqueries/master/_media-queries.scss" )
-    },
 
-    { 
-        "name": "_general_mixins.scss",
-        "url":( "https://raw.githubusercontent.com/"
-                "SwankSwashbucklers/some-sassy-mixins/master/mixins.scss" ) 
-    } 
+UPDATE_SASS_TEMPLATE = Template("""\
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+${download_str}
+
+RESOURCES = (
+[ 
+${resources}
 ]
 )
 
 def populate_resource(resource_name, resource_url):
     try:
-        with urlopen(resource_url) as response, \\
-                open(resource_name, 'wb') as f:
-            copyfileobj(response, f)
+        fetch(resource_url, resource_name)
         print("Successfully populated '{}'".format(resource_name))
     except Exception as e:
         message = "Could not populate resource" \\
@@ -217,8 +447,9 @@ def populate_resource(resource_name, resource_url):
 
 
 print("Updating external sass resources")
-for resource in RESOURCES:
-    populate_resource(resource['name'], resource['url'])
+with ThreadPoolExecutor(max_workers=len(RESOURCES)) as pool:
+    list(pool.map( lambda r: populate_resource(r['name'], r['url']), 
+                   RESOURCES ))
 """ )
 
 
@@ -307,12 +538,122 @@ parser.add_argument("-d", "--deploy",
     action="store_true",
     help="package site for movement to deployment server. Default path is the"
     "current working directory, but the path flag will override that value" )
-parser.add_argument("-r", "--reuse",
+parser.add_argument("-c", "--clean",
+    action="store_true",
+    help="ignore the build manifest of an already built website at the "
+    "targeted path and rebuild everything from scratch. By default only the "
+    "resources whose inputs have changed since the last build are regenerated" )
+parser.add_argument("-j", "--jobs",
+    type=int,
+    default=os.cpu_count() or 1,
+    help="maximum number of external tools (i.e. inkscape) to run at once" )
+parser.add_argument("-t", "--tasks",
+    type=int,
+    default=4,
+    help="maximum number of build stages (i.e. the favicons and the "
+    "stylesheets) to run at once. Each stage starts as soon as the stages "
+    "whose output it needs are done" )
+parser.add_argument("-w", "--watch",
+    action="store_true",
+    help="keep running after the site is built, and rebuild whatever is "
+    "affected when files in the project's dev or res directories change" )
+parser.add_argument("-f", "--fingerprint",
+    action="store_true",
+    help="also serve every static asset under a name containing a hash of its "
+    "content, which can be cached forever. The asset() function available "
+    "in the views resolves a name to its fingerprinted version" )
+parser.add_argument("-s", "--static",
     action="store_true",
-    help="if an already built website exists at the targeted path, attempt to"
-    "reuse already present resources (i.e. images, favicon elements and other" 
-    "static resources)" )
+    help="render the views to minified html files while building, so they are "
+    "served from disk. Views containing a '%%# dynamic' line, or that can not "
+    "be rendered without a request, are still rendered on every request" )
+parser.add_argument("--optimize-images",
+    action="store_true",
+    help="recompress the png and jpeg images in res/img with imagemagick, "
+    "png images losslessly and jpeg images at --image-quality, serving "
+    "whichever of the two versions is smaller" )
+parser.add_argument("--image-widths",
+    type=int,
+    nargs='+',
+    default=[],
+    help="also make versions of the png and jpeg images scaled down to each "
+    "of these widths (never up), served as NAME-WIDTHw.EXT" )
+parser.add_argument("--webp",
+    action="store_true",
+    help="also make webp versions of the png and jpeg images and of their "
+    "scaled down versions, served with .webp added to their names" )
+parser.add_argument("--image-quality",
+    type=int,
+    default=85,
+    help="quality of the recompressed jpeg and the webp images, 1 to 100" )
+parser.add_argument("-o", "--offline",
+    action="store_true",
+    help="build without network access, using the copies of downloaded "
+    "resources (i.e. bottle.py) in the shared download cache" )
+parser.add_argument("-l", "--link",
+    type=str,
+    choices=[ "auto", "copy", "hardlink", "reflink", "symlink" ],
+    default="auto",
+    help="how files from dev and res are placed in the generated site. The "
+    "links avoid copying data, falling back to a copy where they can not be "
+    "made (i.e. a hardlink across devices). Reflinks are copy on write clones "
+    "on filesystems that support them (i.e. btrfs or xfs), while hardlinks "
+    "also see edits made to a source file in place. auto symlinks in dev mode "
+    "and reflinks when deploying" )
+parser.add_argument("-k", "--keep",
+    type=int,
+    default=1,
+    help="number of previous deployment builds to keep for --rollback. "
+    "Deployment builds are made next to the live site and swapped in once "
+    "they are complete, after which a running app.py is told to reload. One "
+    "more build is kept, to make the next build in, so only what changed "
+    "since it is written again" )
+parser.add_argument("--rollback",
+    action="store_true",
+    help="swap the most recent previous deployment build back in and exit. "
+    "The build rolled back from is kept as the oldest, so rolling back again "
+    "goes further back" )
+parser.add_argument("--package",
+    type=str,
+    nargs='?',
+    const="packages",
+    help="pack the built site into DIR/www-TIME.tar.gz, and list the path, "
+    "size and hash of every file in it in DIR/www-TIME.json. If DIR holds the "
+    "list of an earlier package, DIR/www-TIME.delta.tar.gz is written too, "
+    "holding only the files changed since. The .package.json in a delta "
+    "names the files to delete when it is unpacked over the earlier site" )
+parser.add_argument("--since",
+    type=str,
+    help="the file list of the package the server has (www-TIME.json), to "
+    "make the delta package against instead of the latest one in DIR" )
+parser.add_argument("--nginx",
+    action="store_true",
+    help="also write nginx.conf into the built site, an nginx server block "
+    "that serves the static assets straight from disk and passes every other "
+    "request on to app.py. Include www/nginx.conf in the http block of the "
+    "nginx configuration, and reload nginx when a build says it changed" )
+parser.add_argument("--server-name",
+    type=str,
+    default="_",
+    help="server_name of the nginx server block" )
+parser.add_argument("--upstream",
+    type=str,
+    default="127.0.0.1:8080",
+    help="address app.py is listening on, for the nginx server block" )
+parser.add_argument("--profile", 
+    type=str,
+    nargs='?',
+    const="profile.json",
+    help="time each build stage and every external command it runs, and write "
+    "the results to the given json file along with a chrome trace-event file "
+    "(*.trace.json) that can be loaded in chrome://tracing" )
 args = parser.parse_args()
+if args.profile: args.profile = os.path.abspath(args.profile)
+if args.package: args.package = os.path.abspath(args.package)
+if args.since: args.since = os.path.abspath(args.since)
+
+if args.link == "auto":
+    args.link = "reflink" if args.deploy else "symlink"
 
 if args.path is None:
     if args.deploy:
@@ -322,21 +663,25 @@ if args.path is None:
 
 $ph{Overrides}
 ${override_str}
+$ph{Downloads}
+${download_str}
 $ph{Templates}
 
 APP_PY_TEMPLATE = Template(\"""\\
 from bottle import run, route, get, post, error
-from bottle import static_file, template, request
-from bottle import HTTPError
+from bottle import template, request, BaseTemplate
+from bottle import HTTPError, HTTPResponse
+from bottle import parse_date, parse_range_header
 
 $ph{Command Line Interface}
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 from inspect import getframeinfo, currentframe
 from os.path import dirname, abspath
-import os
+from email.utils import formatdate
+import json, os, signal, socket, sys, traceback
 
-parser = argparse.ArgumentParser(
-    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+parser = ArgumentParser(
+    formatter_class=ArgumentDefaultsHelpFormatter,
     description=__doc__ )                                
 parser.add_argument('-d', '--deploy',
     action='store_true',
@@ -349,10 +694,54 @@ parser.add_argument('-p', '--port',
     type=str,
     default="8080",
     help='port to run server on' ) 
+parser.add_argument('-c', '--cache', 
+    type=float,
+    default=0,
+    help='megabytes of rendered views to keep in memory, by url, and answer '
+    'conditional requests for without rendering them again. Views with a '
+    '"%%# nocache" line are always rendered' ) 
+parser.add_argument('--cache-ttl', 
+    type=float,
+    default=300,
+    help='seconds a rendered view is kept in the cache' ) 
+parser.add_argument('-s', '--server', 
+    type=str,
+    choices=[ 'cheroot', 'cherrypy', 'waitress' ],
+    default='cheroot',
+    help='wsgi server to run for deployment, cherrypy is the server of '
+    'CherryPy < 9 and can not share a port between workers' ) 
+parser.add_argument('-w', '--workers', 
+    type=int,
+    default=1,
+    help='server processes to run for deployment, sharing the port with '
+    'SO_REUSEPORT. Workers that die are started again, and on a SIGHUP new '
+    'workers are started before the old ones finish their requests and exit' ) 
+parser.add_argument('-t', '--threads', 
+    type=int,
+    default=10,
+    help='threads each server process handles requests on' ) 
+parser.add_argument('--backlog', 
+    type=int,
+    default=1024,
+    help='connections to queue while every thread is busy' ) 
+parser.add_argument('--keep-alive', 
+    type=float,
+    default=10,
+    help='seconds to keep an idle connection open for further requests' ) 
 args = parser.parse_args()
+if args.workers > 1 and not (hasattr(os, "fork") and 
+                             hasattr(socket, "SO_REUSEPORT")):
+    parser.error("--workers needs fork and SO_REUSEPORT, i.e. linux")
+if args.workers > 1 and args.server == 'cherrypy':
+    parser.error("--workers needs the cheroot or waitress server")
+# the workers of a deployment are started by a supervisor, so that on a SIGHUP 
+# new ones can take over the port before the old ones stop, even if only one
+SUPERVISED = args.deploy and args.server != 'cherrypy' and \\
+    hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT")
 
 # change working directory to script directory
-os.chdir(dirname(abspath(getframeinfo(currentframe()).filename)))
+SCRIPT = abspath(getframeinfo(currentframe()).filename)
+os.chdir(dirname(SCRIPT))
 
 $ph{Main Site Routes}
 ${main_routes}
@@ -360,7 +749,11 @@ $ph{API and Additional Site Routes}
 ${api_routes}
 
 $ph{Static Routes}
+STATIC_ASSETS = { # path: (file, size, mimetype, etag, mtime, last modified,
+                  #        precompressed variant sizes by content encoding)
 ${static_routes}
+$sh{Prerendered View Routes}
+${html_routes}
 $sh{Favicon Routes}
 ${favicon_routes}
 $sh{Image Routes}
@@ -371,14 +764,246 @@ $sh{Stylesheet Routes}
 ${css_routes}
 $sh{Javascript Routes}
 ${js_routes}
+}
+
+$sh{Page Cache}
+from collections import OrderedDict
+from threading import Lock
+from hashlib import sha1
+from time import time
+
+class PageCache():
+    \\\"""
+    Least recently used rendered views, keyed by url, and dropped once they 
+    are older than ttl seconds or when they take up more than size bytes.
+    \\\"""
+
+    def __init__(self, size, ttl):
+        self.size, self.ttl, self.used = size, ttl, 0
+        self.pages, self.lock, self.stamp = OrderedDict(), Lock(), None
+
+    def get(self, key, stamp=None):
+        with self.lock:
+            if stamp != self.stamp: # the views were changed
+                self.pages.clear()
+                self.used, self.stamp = 0, stamp
+            page = self.pages.get(key)
+            if page and time() - page[2] > self.ttl:
+                self.used -= len(self.pages.pop(key)[0])
+                return None
+            if page: self.pages.move_to_end(key)
+            return page
+
+    def put(self, key, body):
+        page = (body, '"{}"'.format(sha1(body).hexdigest()[:20]), time())
+        with self.lock:
+            if key in self.pages: self.used -= len(self.pages.pop(key)[0])
+            self.pages[key] = page
+            self.used += len(body)
+            while self.used > self.size and self.pages:
+                self.used -= len(self.pages.popitem(last=False)[1][0])
+        return page
+
+PAGE_CACHE = PageCache(int(args.cache * 1024 * 1024), args.cache_ttl)
+
+def render_page(name, cache=True):
+    if not (cache and PAGE_CACHE.size):
+        return template(name, request=request, template=name)
+    # under the development server views can change without a restart
+    stamp = None if args.deploy else \\
+        max( e.stat().st_mtime_ns for e in os.scandir("views") )
+    key = (name, request.path, request.query_string)
+    body, etag, created = PAGE_CACHE.get(key, stamp) or PAGE_CACHE.put( key, 
+        template(name, request=request, template=name).encode("utf-8") )
+    if etag in request.environ.get("HTTP_IF_NONE_MATCH", ""):
+        return HTTPResponse(status=304, ETag=etag)
+    return HTTPResponse(body, ETag=etag, 
+                        **{ "Content-Type": "text/html; charset=UTF-8" })
+
+$sh{Fingerprinted Assets}
+ASSET_MANIFEST = {} # asset path: path with a content hash, see build.py -f
+if os.path.isfile("asset-manifest.json"):
+    with open("asset-manifest.json", 'r') as f:
+        ASSET_MANIFEST = json.load(f)
+FINGERPRINTS = { v: k for k, v in ASSET_MANIFEST.items() }
+
+# views can link to assets with {{asset('styles.min.css')}}
+BaseTemplate.defaults["asset"] = lambda p: "/" + ASSET_MANIFEST.get(p, p)
+
+CRITICAL_CSS = {} # view name: the rules it needs before the stylesheets load
+if os.path.isfile("critical-css.json"):
+    with open("critical-css.json", 'r') as f:
+        CRITICAL_CSS = json.load(f)
+BaseTemplate.defaults["critical_css"] = lambda v: CRITICAL_CSS.get(v, "")
+
+def read_range(f, start, length, chunk=1024*1024):
+    try:
+        f.seek(start)
+        while length > 0:
+            part = f.read(min(length, chunk))
+            if not part: break
+            length -= len(part)
+            yield part
+    finally:
+        f.close()
+
+@get('/<path:path>')
+def load_resource(path):
+    immutable = path in FINGERPRINTS # content can never change under the name
+    path = FINGERPRINTS.get(path, path)
+    if path not in STATIC_ASSETS:
+        return HTTPError(404, "File does not exist.")
+    filename, size, mimetype, etag, mtime, modified, encodings = \\
+        STATIC_ASSETS[path]
+    if not args.deploy: # files can be rewritten under the development server
+        try:
+            stat = os.stat(filename)
+        except OSError: # or removed since the last build
+            return HTTPError(404, "File does not exist.")
+        size, mtime = stat.st_size, int(stat.st_mtime)
+        etag = '"{}-{}"'.format(mtime, size)
+        modified = formatdate(mtime, usegmt=True)
+    headers = { "Content-Type": mimetype, "Last-Modified": modified, 
+                "Accept-Ranges": "bytes" }
+
+    # serve a precompressed variant when the client accepts one
+    if encodings:
+        headers["Vary"] = "Accept-Encoding"
+        accepted = [ e.split(";")[0].strip() for e in 
+                     request.environ.get("HTTP_ACCEPT_ENCODING", "").split(",")
+                     if not e.replace(" ", "").endswith(";q=0") ]
+        for encoding, extension in [ ("br", ".br"), ("gzip", ".gz") ]:
+            if encoding in encodings and encoding in accepted:
+                filename, size = filename + extension, encodings[encoding]
+                etag = etag[:-1] + "-" + encoding + '"'
+                headers["Content-Encoding"] = encoding
+                break
+    headers["ETag"] = etag
+    if immutable and args.deploy:
+        headers["Cache-Control"] = "public, max-age=31536000, immutable"
+
+    if_none_match = request.environ.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        not_modified = if_none_match.strip() == "*" or etag in if_none_match
+    else:
+        since = parse_date( 
+            request.environ.get("HTTP_IF_MODIFIED_SINCE", "").split(";")[0] )
+        not_modified = since is not None and since >= mtime
+    if not_modified:
+        return HTTPResponse(status=304, **headers)
+
+    body = "" if request.method == "HEAD" else open(filename, 'rb')
+    ranges = request.environ.get("HTTP_RANGE")
+    if ranges:
+        ranges = list(parse_range_header(ranges, size))
+        if not ranges:
+            return HTTPError(416, "Requested Range Not Satisfiable", 
+                             **{ "Content-Range": "bytes */{}".format(size) })
+        start, end = ranges[0]
+        headers["Content-Range"] = "bytes {}-{}/{}".format(start, end-1, size)
+        headers["Content-Length"] = str(end - start)
+        if body: body = read_range(body, start, end - start)
+        return HTTPResponse(body, status=206, **headers)
+    headers["Content-Length"] = str(size)
+    return HTTPResponse(body, **headers)
+
 $ph{Error Routes}
 @error(404)
 def error404(error):
     return 'nothing to see here'
 
 $ph{Run Server}
-if args.deploy:
-    run(host=args.ip, port=args.port, server='cherrypy') #deployment
+from bottle import default_app
+from time import sleep
+
+WORKERS = {} # pid: time started, of the server processes when supervising
+
+def restart(signum, frame):
+    # build.py swaps new builds in under a running server, and sends a SIGHUP
+    # to have it restart on the new one, the workers are replaced once the 
+    # restarted supervisor has started new ones
+    os.environ["APP_RETIRING"] = ",".join(str(pid) for pid in WORKERS)
+    os.execv(sys.executable, [ sys.executable, SCRIPT ] + sys.argv[1:])
+
+def stop(signum, frame): # the servers finish the requests they have first
+    raise KeyboardInterrupt
+
+def serve():
+    signal.signal(signal.SIGTERM, stop)
+    if args.server == 'waitress': # bottle can not hand it a shared port
+        from waitress import serve as serve_waitress
+        listener = socket.socket( socket.AF_INET6 if ':' in args.ip else 
+                                  socket.AF_INET )
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if SUPERVISED:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        listener.bind((args.ip, int(args.port)))
+        try:
+            serve_waitress( default_app(), sockets=[ listener ], 
+                threads=args.threads, backlog=args.backlog, 
+                channel_timeout=args.keep_alive )
+        except KeyboardInterrupt:
+            pass
+    else:
+        run( host=args.ip, port=args.port, server=args.server, 
+             numthreads=args.threads, request_queue_size=args.backlog, 
+             timeout=args.keep_alive, 
+             **({ "reuse_port": True } if SUPERVISED else {}) )
+
+def supervise():
+    stopping = []
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGINT, signal.SIG_IGN) # sent by supervisor
+            try:
+                serve()
+            except KeyboardInterrupt: # stopped by the supervisor
+                pass
+            except BaseException: # the supervisor only sees the exit status
+                traceback.print_exc()
+                sys.stderr.flush()
+                os._exit(1)
+            os._exit(0)
+        WORKERS[pid] = time()
+    def shutdown(signum, frame):
+        stopping.append(signum)
+        for pid in WORKERS: os.kill(pid, signal.SIGTERM)
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    retiring = [ int(p) for p in 
+                 os.environ.pop("APP_RETIRING", "").split(",") if p ]
+    for worker in range(args.workers): spawn()
+    if retiring: # the new workers are sharing the port by now
+        sleep(1)
+        for pid in retiring: 
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError: # already gone
+                pass
+    while WORKERS or retiring:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = WORKERS.pop(pid, None)
+        if pid in retiring:
+            retiring.remove(pid)
+        elif started is not None and not stopping:
+            print("Worker {} exited ({}), starting another".format(pid, status))
+            if time() - started < 1: sleep(1) # do not spin if it can not start
+            spawn()
+
+if SUPERVISED:
+    if hasattr(signal, "SIGHUP"):
+        with open(os.getcwd() + ".pid", 'w') as f:
+            f.write(str(os.getpid()))
+        signal.signal(signal.SIGHUP, restart)
+    supervise() #deployment, in worker processes
+elif args.deploy: # no pid file, as restarting would drop connections
+    serve() #deployment
 else:
     run(host=args.ip, port=args.port, debug=True, reloader=True) #development 
 \""" )
@@ -387,21 +1012,79 @@ else:
 MAIN_ROUTE_TEMPLATE = Template(\"""\\
 @route('/${path}')
 def ${method_name}():
-    return template('${template}', request=request, template='${template}')
+    return render_page('${template}', ${cache})
+\""" )
+
+
+STATIC_VIEW_TEMPLATE = Template(\"""\\
+@route('/${path}')
+def ${method_name}():
+    return load_resource('${page}')
 \""" )
 
 
 STATIC_ROUTE_TEMPLATE = Template(\"""\\
-@get('/${path}')
-def load_resource():
-    return static_file('${file}', root='${root}')
+    ${path}: ${asset},\""" )
+
+
+NGINX_CONF_TEMPLATE = Template(\"""\\
+# generated by build.py, include it in the http block of the nginx config and
+# reload nginx when a build adds, removes or renames static assets
+upstream ${upstream_name} {
+    server ${upstream};
+    keepalive 16;
+    keepalive_timeout 5s; # app.py closes idle connections after 10 seconds
+}
+
+server {
+    listen 80;
+    server_name ${server_name};
+    charset utf-8;
+    charset_types text/css text/plain text/xml application/javascript 
+                  application/json image/svg+xml;
+
+    sendfile on;
+    tcp_nopush on;
+    open_file_cache max=10000 inactive=60s;
+    open_file_cache_valid 30s;
+    open_file_cache_errors on;
+    gzip_static on; # the .gz files build.py -d writes next to the assets
+    gzip_vary on;
+    # brotli_static on; # the .br files, needs the ngx_brotli module
+
+    proxy_http_version 1.1;
+    proxy_set_header Connection "";
+    proxy_set_header Host $$host;
+    proxy_set_header X-Real-IP $$remote_addr;
+    proxy_set_header X-Forwarded-For $$proxy_add_x_forwarded_for;
+    proxy_set_header X-Forwarded-Proto $$scheme;
+
+    # static assets, served straight from the built site
+    root ${root};
+${locations}
+
+    location / { # views, api routes and anything else app.py answers
+        proxy_pass http://${upstream_name};
+    }
+
+    location @app { # an asset missing from the build that is swapped in
+        proxy_pass http://${upstream_name};
+    }
+}
 \""" )
 
 
+NGINX_LOCATION_TEMPLATE = Template(\"""\\
+    location = ${path} {
+        try_files ${filepath} @app;
+        add_header Cache-Control "${cache_control}";
+    }\""" )
+
+
 WATCH_SASS_SCRIPT = Template(\"""\\
-from sys import argv
+from sys import argv, exit
 from shutil import rmtree
-from subprocess import Popen
+from subprocess import Popen, call
 from inspect import getframeinfo, currentframe
 from os.path import dirname, abspath, isdir, isfile
 import os
@@ -409,34 +1092,528 @@ import os
 # change working directory to script directory
 os.chdir(dirname(abspath(getframeinfo(currentframe()).filename)))
 
-command = "sass --watch"
-for x in range(1, len(argv)):
-    command += " {0}.scss:../../www/static/css/{0}.css".format(argv[x])
-p = Popen(command, shell=True)
+# first argument is the css output directory, the rest are the stylesheets
+stylesheets = "".join( " {0}.scss:{1}/{0}.css".format(s, argv[1]) 
+                       for s in argv[2:] )
+status = call("sass --update" + stylesheets, shell=True)
+if status: exit(status) # build.py reports the failed compile
+open("${ready_file}", 'w').close() # tell build.py the stylesheets exist
+p = Popen("sass --watch" + stylesheets, shell=True)
 try:
-    while True:
-        pass
+    p.wait()
 except KeyboardInterrupt:
     p.kill()
     if isfile("_all.scss"): os.remove("_all.scss")
+    if isfile("${ready_file}"): os.remove("${ready_file}")
     if isdir(".sass-cache"): rmtree(".sass-cache")
     os.remove("watch.py") # argv[0] contains full path
 \""" )
 
-$ph{Script Body}
-from os.path import relpath, normpath, join, isfile, isdir, splitext
-from shutil import copy, copyfileobj, rmtree
-from urllib.request import urlopen
+$ph{Build Manifest}
+from subprocess import check_output, CalledProcessError, TimeoutExpired
+from os.path import abspath, isfile, islink, samefile
+from shutil import copy, copymode, which
+from hashlib import sha1
+import json
+
+FICLONE = 0x40049409 # _IOW(0x94, 9, int) from linux/fs.h
+
+def file_hash(filepath):
+    digest = sha1()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def clone_file(src, dst):
+    \""" copy src to dst inside the kernel, sharing its blocks if possible \"""
+    try:
+        from fcntl import ioctl
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            try:
+                ioctl(d.fileno(), FICLONE, s.fileno())
+                done = "reflink"
+            except OSError: # not a copy on write filesystem
+                size, offset, done = os.fstat(s.fileno()).st_size, 0, "copy"
+                while offset < size:
+                    count = os.copy_file_range( s.fileno(), d.fileno(), 
+                                                size - offset, offset, offset )
+                    if not count: break
+                    offset += count
+        copymode(src, dst)
+        return done
+    except (ImportError, AttributeError, OSError):
+        return None
+
+
+def stage_file(src, dst, link="copy"):
+    \"""
+    Place src at dst as a symlink, hardlink or reflink when asked to, falling 
+    back to a copy when the link can not be made. Returns what was done.
+    \"""
+    if islink(dst) or isfile(dst): 
+        os.remove(dst) # never write through a link into the source
+    try:
+        if link == "symlink": 
+            os.symlink(abspath(src), dst)
+            return "symlink"
+        if link == "hardlink":
+            os.link(src, dst)
+            return "hardlink"
+    except OSError: # i.e. across devices, or no symlink privilege on windows
+        pass
+    done = clone_file(src, dst) if link == "reflink" else None
+    if done: return done
+    copy(src, dst)
+    return "copy"
+
+
+class BuildManifest():
+    \"""
+    Persistent record of the inputs, outputs and tool versions of a build, so 
+    that the stages of the next build can skip work whose inputs are unchanged.
+    \"""
+
+    VERSION = 1
+
+    def __init__(self, filepath, clean=False, link="copy"):
+        self.filepath, self.link = filepath, link
+        self.previous = { "inputs": {}, "outputs": {}, "stages": {}, 
+                          "tools": {} }
+        if not clean and isfile(filepath):
+            try:
+                with open(filepath, 'r') as f:
+                    data = json.load(f)
+                if data.get("version") == self.VERSION:
+                    self.previous = data
+            except (OSError, ValueError):
+                pass # an unreadable manifest just means a full rebuild
+        self.inputs, self.outputs, self.stages, self.tools = {}, {}, {}, {}
+
+    def hash(self, filepath):
+        \""" content hash of an input, reused while its mtime and size hold \"""
+        key  = abspath(filepath)
+        stat = os.stat(key)
+        prev = self.previous["inputs"].get(key)
+        if prev and prev[:2] == [stat.st_mtime_ns, stat.st_size]:
+            digest = prev[2]
+        else:
+            digest = file_hash(key)
+        self.inputs[key] = [stat.st_mtime_ns, stat.st_size, digest]
+        return digest
+
+    def tool_version(self, tool):
+        \""" version string of an external tool, rechecked if it is replaced \"""
+        if tool not in self.tools:
+            path = which(tool)
+            mtime = os.stat(path).st_mtime_ns if path else None
+            prev = self.previous["tools"].get(tool)
+            if prev and prev[:2] == [path, mtime]:
+                self.tools[tool] = prev
+            else:
+                try:
+                    version = check_output([path, "--version"], 
+                        stderr=STDOUT, timeout=60).decode(errors='replace')
+                except (OSError, TypeError, CalledProcessError, 
+                        TimeoutExpired):
+                    version = ""
+                self.tools[tool] = [path, mtime, version.strip()]
+        return self.tools[tool][2]
+
+    def copy(self, src, dst):
+        \""" stage src at dst unless the same content was already placed there \"""
+        digest = self.hash(src)
+        if (self.previous["outputs"].get(dst) != digest or not isfile(dst) or
+                not self.staged(src, dst)):
+            if stage_file(src, dst, self.link) == "copy":
+                PROFILER.count("files copied")
+                PROFILER.count("bytes copied", os.path.getsize(dst))
+            else:
+                PROFILER.count("files linked")
+        else:
+            PROFILER.count("files reused")
+        self.outputs[dst] = digest
+
+    def staged(self, src, dst):
+        \""" check if dst was placed the way self.link would place src now \"""
+        if islink(dst) or self.link == "symlink":
+            return islink(dst) == (self.link == "symlink")
+        if self.link == "hardlink": # a copy is all it can be across devices
+            return samefile(src, dst) or \\
+                os.stat(src).st_dev != os.stat(dst).st_dev
+        return not samefile(src, dst)
+
+    @staticmethod
+    def key(*parts):
+        return sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def is_current(self, stage, key):
+        \""" check if a stage already ran with the same key and kept outputs \"""
+        prev = self.previous["stages"].get(stage)
+        if (not prev or prev["key"] != key or 
+                not all(isfile(o) for o in prev["outputs"])):
+            return False
+        self.record(stage, key, prev["outputs"])
+        return True
+
+    def record(self, stage, key, outputs):
+        self.stages[stage] = { "key": key, "outputs": sorted(outputs) }
+        for output in outputs:
+            self.outputs.setdefault(output, None)
+
+    def save(self):
+        \""" remove outputs the build no longer produces and write manifest \"""
+        for output in self.previous["outputs"]:
+            if output not in self.outputs and isfile(output):
+                os.remove(output)
+        data = { "version": self.VERSION, "inputs": self.inputs, 
+                 "outputs": self.outputs, "stages": self.stages, 
+                 "tools": self.tools }
+        with open(self.filepath + ".tmp", 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(self.filepath + ".tmp", self.filepath)
+
+$ph{File Watcher}
+from select import select
 from time import sleep
-from re import match
+import ctypes, ctypes.util, struct, sys
+
+class FileWatcher():
+    \"""
+    Blocks until files below the watched directories change. Uses inotify on 
+    linux and falls back to polling modification times everywhere else.
+    \"""
+
+    IN_EVENTS     = 0x2 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 # modify, close 
+                                      # write, moved from/to, create, delete
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED    = 0x8000
+    IN_ISDIR      = 0x40000000
+    IN_EVENT      = struct.Struct("iIII")
+
+    def __init__(self, paths, ignore=lambda name: False, interval=0.5):
+        self.paths, self.ignore, self.interval = paths, ignore, interval
+        self.fd, self.watches = -1, {}
+        if sys.platform.startswith("linux"):
+            try:
+                self.libc = ctypes.CDLL(ctypes.util.find_library("c"), 
+                                        use_errno=True)
+                self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+            except (OSError, AttributeError):
+                self.fd = -1
+        if self.fd < 0:
+            self.snapshot = self.scan()
+        else:
+            for path in paths:
+                self.add_watches(path)
+
+    def add_watches(self, path):
+        for root, dirs, files in os.walk(path):
+            dirs[:] = [ d for d in dirs if not self.ignore(d) ]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), 
+                                             self.IN_EVENTS)
+            if wd >= 0: self.watches[wd] = root
+
+    def read(self):
+        changes, data, offset = set(), os.read(self.fd, 1 << 16), 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.IN_EVENT.unpack_from(data, offset)
+            offset += self.IN_EVENT.size + length
+            name = os.fsdecode(data[offset-length:offset].rstrip(b'\\0'))
+            if mask & self.IN_Q_OVERFLOW: # events were lost, assume the worst
+                changes.update(self.paths)
+            elif mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+            elif wd in self.watches and name and not self.ignore(name):
+                path = join(self.watches[wd], name)
+                if mask & self.IN_ISDIR and mask & (0x80 | 0x100):
+                    self.add_watches(path)
+                changes.add(path)
+        return changes
+
+    def scan(self):
+        snapshot = {}
+        for path in self.paths:
+            for root, dirs, files in os.walk(path):
+                dirs[:] = [ d for d in dirs if not self.ignore(d) ]
+                for filename in files:
+                    if self.ignore(filename): continue
+                    try:
+                        stat = os.stat(join(root, filename))
+                    except OSError: # removed while scanning
+                        continue
+                    snapshot[join(root, filename)] = \\
+                        (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def wait(self, debounce=0.2):
+        \""" block until something changes and return the changed paths once 
+            no more changes have come in for the debounce period \"""
+        if self.fd < 0:
+            current = self.snapshot
+            while current == self.snapshot:
+                sleep(self.interval)
+                current = self.scan()
+            while True:
+                sleep(debounce)
+                latest = self.scan()
+                if latest == current: break
+                current = latest
+            changes = { p for p in set(current) | set(self.snapshot) 
+                        if current.get(p) != self.snapshot.get(p) }
+            self.snapshot = current
+            return changes
+        changes = set()
+        while not changes:
+            changes = self.read()
+        while select([self.fd], [], [], debounce)[0]:
+            changes |= self.read()
+        return changes
+
+$ph{Sass Dependencies}
+from os.path import join, dirname, basename, relpath, normpath, isfile, splitext
+from re import compile, MULTILINE, DOTALL
+
+class SassGraph():
+    \"""
+    The @import, @use and @forward graph of a sass directory, kept on disk so 
+    only the files changed since the last build are parsed again. Each 
+    stylesheet is rebuilt when a file among its dependencies changes.
+    \"""
+
+    EXTENSIONS = [ ".scss", ".sass", ".css" ]
+    RE_COMMENT = compile(r'/\\*.*?\\*/|^\\s*//.*?$', MULTILINE | DOTALL)
+    RE_IMPORT  = compile(r'@(?:import|use|forward)\\s+([^;\\n]+)')
+    RE_STRING  = compile(r'["\\']([^"\\']+)["\\']')
+
+    def __init__(self, root, filepath):
+        self.root, self.filepath, self.files = root, filepath, {}
+        if isfile(filepath):
+            try:
+                with open(filepath, 'r') as f:
+                    self.files = json.load(f) # path: [mtime, size, imports]
+            except (OSError, ValueError): # unreadable, parse everything again
+                self.files = {}
+
+    def is_sass(self, path):
+        return splitext(path)[-1].lower() in self.EXTENSIONS[:2]
+
+    def resolve(self, name, importer):
+        \""" the file an import refers to, the way sass looks for it \"""
+        if name.startswith(("sass:", "http://", "https://", "url(")) or \\
+                name.endswith(".css"):
+            return None
+        for base in [ dirname(importer), "" ]:
+            path = normpath(join(base, name))
+            folder, stem = dirname(path), basename(path)
+            candidates = [ path, join(folder, "_" + stem) ] \\
+                if splitext(stem)[-1] in self.EXTENSIONS else \\
+                [ join(folder, p + e) for e in self.EXTENSIONS 
+                  for p in [ stem, "_" + stem ] ] + \\
+                [ join(path, p + e) for e in self.EXTENSIONS 
+                  for p in [ "_index", "index" ] ]
+            for candidate in candidates:
+                if isfile(join(self.root, candidate)):
+                    return candidate.replace('\\\\', '/')
+        return None
+
+    def parse(self, path):
+        \""" the names a file imports, they are resolved when the graph is 
+            walked, so files being added or removed never need a parse \"""
+        with open(join(self.root, path), 'r', encoding="utf-8") as f:
+            source = self.RE_COMMENT.sub("", f.read())
+        return sorted(set( n for m in self.RE_IMPORT.finditer(source)
+                           for n in self.RE_STRING.findall(m.group(1)) ))
+
+    def scan(self):
+        \""" bring the graph up to date, returning the files that changed \"""
+        found, changed = {}, set()
+        for root, dirs, files in os.walk(self.root):
+            dirs[:] = [ d for d in dirs if not d.startswith('.') ]
+            for filename in files:
+                if not self.is_sass(filename): continue
+                path = relpath(join(root, filename), self.root).replace(
+                    '\\\\', '/')
+                stat = os.stat(join(self.root, path))
+                found[path] = [ stat.st_mtime_ns, stat.st_size ]
+        for path in set(self.files) - set(found):
+            changed.add(path)
+            del self.files[path]
+        for path, stamp in found.items():
+            if self.files.get(path, [None, None])[:2] != stamp:
+                changed.add(path)
+                self.files[path] = stamp + [ None ]
+        for path in changed & set(self.files):
+            self.files[path][2] = self.parse(path)
+        if changed:
+            with open(self.filepath + ".tmp", 'w') as f:
+                json.dump(self.files, f, indent=1, sort_keys=True)
+            os.replace(self.filepath + ".tmp", self.filepath)
+        return changed
+
+    def dependencies(self, path):
+        \""" a file and everything it imports, directly or not \"""
+        found, pending = set(), [ path ]
+        while pending:
+            current = pending.pop()
+            if current in found or current not in self.files: continue
+            found.add(current)
+            pending.extend( self.resolve(n, current) 
+                            for n in self.files[current][2] )
+        return found
+
+    def stylesheets(self):
+        \""" the top level stylesheets, the ones compiled to css \"""
+        return sorted( p for p in self.files if "/" not in p and 
+                       not p.startswith('_') )
+
+    def partials(self, key=None):
+        \""" every partial in the given order, leaving out the ones an earlier 
+            partial already imports, so importing them all does it once \"""
+        partials, imported = [], set()
+        for path in sorted(sorted( p for p in self.files if "/" in p ), key=key):
+            if path not in imported:
+                partials.append(path)
+                imported |= self.dependencies(path)
+        return partials
+
+$ph{Task Scheduler}
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from time import perf_counter
+
+class TaskGraph():
+    \"""
+    The stages of a build as tasks declaring the names of what they read and 
+    write. A task starts once every task writing one of its inputs is done, 
+    on a pool of worker threads. The first failure stops anything new from 
+    starting, and is raised once the running tasks have finished. The chain 
+    of tasks the build waited on, its critical path, is kept for the profile.
+    \"""
+
+    def __init__(self, workers):
+        self.workers, self.tasks, self.results = max(workers, 1), {}, {}
+
+    def add(self, name, function, inputs=(), outputs=()):
+        \""" results are kept by output name, one value for each output \"""
+        self.tasks[name] = (function, set(inputs), list(outputs))
+
+    def execute(self, name):
+        function, inputs, outputs = self.tasks[name]
+        begin = perf_counter()
+        with PROFILER.stage(name):
+            result = function()
+        return (result if len(outputs) > 1 else [ result ]), \\
+               (begin, perf_counter())
+
+    def run(self):
+        writers  = lambda inputs: { n for n, (function, i, outputs) in 
+                                    self.tasks.items() if inputs & set(outputs) }
+        requires = { n: writers(inputs) - { n } 
+                     for n, (function, inputs, outputs) in self.tasks.items() }
+        pending, running, times, failure = dict(requires), {}, {}, None
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                for name in [ n for n, r in pending.items() if r <= set(times) ]:
+                    del pending[name]
+                    running[pool.submit(self.execute, name)] = name
+                if not running: # nothing can start, and nothing will finish
+                    raise Exception("Tasks waiting on each other: " + 
+                                    ", ".join(sorted(pending)))
+                done, waiting = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results, times[name] = future.result()
+                    except BaseException as exception:
+                        failure = failure or exception
+                        continue
+                    self.results.update(zip(self.tasks[name][2], results))
+                if failure: # let what is running finish, start nothing else
+                    pending.clear()
+                    for future in waiting: future.cancel()
+        if failure: raise failure
+
+        # walk back from the last task to finish through the inputs it waited on
+        path, name = [], max(times, key=lambda n: times[n][1], default=None)
+        while name:
+            path.append([ name, round(times[name][1] - times[name][0], 4) ])
+            name = max(requires[name], key=lambda n: times[n][1], default=None)
+        PROFILER.critical_path = path[::-1]
+        return self.results
+
+$ph{Script Body}
+from os.path import relpath, normpath, join, isfile, isdir, splitext, dirname
+from os.path import expanduser, abspath, basename
+from concurrent.futures import ThreadPoolExecutor
+from shutil import rmtree, copytree
+from tempfile import mkdtemp
+from datetime import datetime
+from io import BytesIO
+import tarfile
+from email.utils import formatdate
+from mimetypes import guess_type, add_type
+import gzip, signal
+
+try: # optional, only used to precompress assets
+    import brotli
+except ImportError:
+    brotli = None
+from time import sleep, time
+from re import match, search, findall, compile, MULTILINE, DOTALL, IGNORECASE
 from sys import exit
 
 SCRIPT_DIR   = os.getcwd()
 PROJECT_NAME = relpath(SCRIPT_DIR, "..")
+CACHE_DIR    = os.environ.get("WEBSITR_CACHE", 
+                              join(expanduser("~"), ".cache", "websitr"))
+WATCH_READY  = ".watch-ready"
+SASS_GRAPH   = ".sass-graph.json" # the sass import graph, beside the manifest
+STAGING_DIR  = "www.staging" # deployment builds are made here, then swapped in
+BUILDS_DIR   = "www.builds"  # and the builds they replaced are kept here
+DOWNLOAD_TTL = 24 * 60 * 60  # seconds before a download is revalidated
+RE_DYNAMIC_VIEW = compile(r'^\\s*%\\s*#\\s*dynamic\\b', MULTILINE)
+RE_NOCACHE_VIEW = compile(r'^\\s*%\\s*#\\s*nocache\\b', MULTILINE)
+RE_PLACEHOLDER  = compile(r'^([ \\t]*)<meta name="(\\w+)">[ \\t]*$', 
+                          MULTILINE)
+RE_VIEW_INCLUDE = compile(r'^[ \\t]*%[ \\t]*(include|rebase)\\(\\s*[\\'"]([^\\'"]+)'
+                          r'[\\'"].*$', MULTILINE)
+RE_VIEW_BASE    = compile(r'\\{\\{\\s*!?\\s*base\\s*\\}\\}')
+RE_MARKUP_TAG   = compile(r'<([a-zA-Z][\\w-]*)')
+RE_MARKUP_CLASS = compile(r'\\bclass\\s*=\\s*["\\']([^"\\']*)["\\']')
+RE_MARKUP_ID    = compile(r'\\bid\\s*=\\s*["\\']([^"\\'{}\\s]+)["\\']')
+RE_CSS_COMMENT  = compile(r'/\\*.*?\\*/', DOTALL)
+RE_CSS_PARENS   = compile(r'\\([^()]*\\)|\\[[^\\]]*\\]')
+RE_CSS_COMPOUND = compile(r'\\s*[>+~]\\s*|\\s+')
+CRITICAL_BYTES  = 14 * 1024 # markup sent in the first round trip of a page
+FONT_PRELOADS   = { ".woff2": "font/woff2", ".woff": "font/woff", # best first
+                    ".ttf": "font/ttf", ".otf": "font/otf" }
+RE_HTML_MINIFY  = compile(r'(<(pre|textarea|script|style)\\b.*?</\\2\\s*>|'
+                          r'<!--\\[if.*?-->)|((?<=\\s)<!--.*?-->\\s*|<!--.*?-->)|'
+                          r'\\s+', DOTALL | IGNORECASE)
 STATIC_ROUTE = lambda p, f, r: \\
-    ( STATIC_ROUTE_TEMPLATE, { "path": p, "file": f, "root": r } )
-MAIN_ROUTE   = lambda p, m, t: \\
-    ( MAIN_ROUTE_TEMPLATE, { "path": p, "method_name": m, "template": t } )
+    ( STATIC_ROUTE_TEMPLATE, { "path": p, "filepath": join(r, f) } )
+MAIN_ROUTE   = lambda p, m, t, c: ( MAIN_ROUTE_TEMPLATE, 
+    { "path": p, "method_name": m, "template": t, "cache": c } )
+STATIC_VIEW  = lambda p, m, h: \\
+    ( STATIC_VIEW_TEMPLATE, { "path": p, "method_name": m, "page": h } )
+ASSET_ROUTES = [ "html_routes", "static_routes", "favicon_routes", 
+                 "image_routes", "font_routes", "css_routes", "js_routes" ]
+PIPELINE_IMAGES = [ ".png", ".jpg", ".jpeg" ] # handled by generate_images
+SCRIPT_COMPILERS = { # source extension: command compiling it into directory d
+    ".ts":     lambda s, d: [ "tsc", "--noResolve", "--target", "ES5", 
+        "--outFile", join(d, splitext(basename(s))[0] + ".js"), s ],
+    ".coffee": lambda s, d: [ "coffee", "--compile", "--output", d, s ] }
+SCRIPT_TYPES = [ ".js" ] + list(SCRIPT_COMPILERS)
+RE_SCRIPT_REQUIRE = compile( r'^\\s*(?:///\\s*<reference\\s+path=|'
+                             r'(?://|#)=\\s*require\\s+)["\\']?([^"\\'\\s>]+)', 
+                             MULTILINE )
+COMPRESSIBLE = [ ".css", ".js", ".svg", ".html", ".txt", ".xml", ".json", 
+                 ".map", ".ico", ".eot", ".ttf", ".otf" ]
+COMPRESSORS  = [ (".gz", lambda d: gzip.compress(d, 9, mtime=0)) ] + \\
+               ([ (".br", brotli.compress) ] if brotli else [])
+
+add_type("image/webp", ".webp") # not known to older pythons
 
 def fatal_exception(exception, message="", cleanup=True):
     print("*******SCRIPT FAILED*******")
@@ -445,35 +1622,453 @@ def fatal_exception(exception, message="", cleanup=True):
     if cleanup:
         try:
             os.chdir(args.path)
-            rmtree('www')
+            rmtree(STAGING_DIR if args.deploy else 'www')
         except Exception as e:
             print(e)
     exit(1)
 
 
-def migrate_files(directory, destination):
+def previous_builds():
+    \""" the kept deployment builds, the most recently replaced first \"""
+    if not isdir(join(args.path, BUILDS_DIR)): return []
+    return sorted( [ join(args.path, BUILDS_DIR, b) for b in 
+                     os.listdir(join(args.path, BUILDS_DIR)) ], reverse=True )
+
+
+def retired_build(oldest=False):
+    \""" where to keep the build being replaced, a build that was rolled back 
+        from is kept as the oldest so a further --rollback goes further back \"""
+    if not isdir(join(args.path, BUILDS_DIR)): 
+        os.makedirs(join(args.path, BUILDS_DIR))
+    return join( args.path, BUILDS_DIR, ("0-" if oldest else "") + 
+                 datetime.now().strftime("%Y%m%d-%H%M%S-%f") )
+
+
+def copy_live_file(src, dst):
+    \""" start a deployment build from a file of the live site \"""
+    if stage_file(src, dst, "reflink") == "copy":
+        PROFILER.count("files copied")
+        PROFILER.count("bytes copied", os.path.getsize(dst))
+    else:
+        PROFILER.count("files linked")
+
+
+def reload_app():
+    \""" tell a running app.py -d to restart on the site that was swapped in \"""
+    pidfile = join(args.path, "www.pid")
+    if not isfile(pidfile) or not hasattr(signal, "SIGHUP"): return
+    try:
+        with open(pidfile, 'r') as f:
+            pid = int(f.read())
+        cmdline = "/proc/{}/cmdline".format(pid)
+        if isfile(cmdline): # make sure the pid was not reused since
+            with open(cmdline, 'rb') as f:
+                if b"app.py" not in f.read(): return
+        os.kill(pid, signal.SIGHUP)
+        print("Told app.py ({}) to reload".format(pid))
+    except (OSError, ValueError): # no longer running
+        pass
+
+
+def write_package(filepath, contents):
+    \""" stream the files in a package listing into a compressed archive \"""
+    listing = json.dumps(contents, indent=1, sort_keys=True).encode()
+    info = tarfile.TarInfo(".package.json")
+    info.size, info.mtime = len(listing), int(datetime.now().timestamp())
+    with tarfile.open( filepath + ".tmp", "w:gz", compresslevel=6, 
+                       dereference=True ) as tar: # symlinks become files
+        tar.addfile(info, BytesIO(listing))
+        for path in sorted(contents["files"]):
+            tar.add(path, arcname=path, recursive=False)
+    os.replace(filepath + ".tmp", filepath)
+    PROFILER.count("files packaged", len(contents["files"]))
+    PROFILER.count("bytes packaged", os.path.getsize(filepath))
+
+
+def package_site(directory):
+    \""" package the built site, and the changes since an earlier package \"""
+    name  = "www-" + datetime.now().strftime("%Y%m%d-%H%M%S")
+    files = {}
+    for root, dirs, filenames in os.walk("."):
+        for filename in filenames:
+            path = normpath(join(root, filename)).replace('\\\\', '/')
+            if path not in [ manifest.filepath, SASS_GRAPH ]:
+                files[path] = [ os.stat(path).st_size, manifest.hash(path) ]
+    if not isdir(directory): os.makedirs(directory)
+    since = args.since or max( [ join(directory, f) for f in 
+        os.listdir(directory) if match(r'www-[0-9-]+\\.json$', f) ] or [None] )
+
+    write_package( join(directory, name + ".tar.gz"), 
+                   { "package": name, "files": files } )
+    if since:
+        with open(since, 'r') as f:
+            base = json.load(f)
+        write_package( join(directory, name + ".delta.tar.gz"), { 
+            "package": name, "base": base["package"], 
+            "files": { p: f for p, f in files.items() 
+                       if base["files"].get(p) != f },
+            "deleted": sorted( p for p in base["files"] if p not in files ) })
+    with open(join(directory, name + ".json"), 'w') as f:
+        json.dump({ "package": name, "files": files }, f, indent=1, 
+                  sort_keys=True)
+    print("Packaged site as {}".format(join(directory, name)))
+
+
+def migrate_files(directory, destination, place=None):
+    place    = place or manifest.copy
     src_path = join(SCRIPT_DIR, directory)
-    if not isdir(destination): os.makedirs(destination)
+    os.makedirs(destination, exist_ok=True) # stages may share parents
     for root, dirs, files in os.walk(src_path):
         for dirname in dirs:
             if dirname.startswith('!') or dirname in ['.DS_STORE']:
                 dirs.remove(dirname)
         for filename in files:
             if not filename.startswith('!'):
-                if not isfile(filename): #added for the reuse flag
-                    copy(join(root, filename), join(destination, filename))
+                place(join(root, filename), join(destination, filename))
                 if not filename.startswith('~'):
                     yield normpath(join(relpath(root, src_path), 
                                         filename) ).replace('\\\\', '/')
 
 
-def migrate_views():
-    return ([ MAIN_ROUTE("", "load_root", "index") ] + 
-            [ MAIN_ROUTE(
-                splitext(r)[0],
-                "load_" + splitext(r.split("/")[-1])[0].replace("-","_"),
-                splitext(r.split("/")[-1])[0] 
-            ) for r in migrate_files("dev/views", "views") ])
+def asset_index_entry(path, filepath):
+    \""" everything app.py needs to serve a file without touching the disk \"""
+    filepath = normpath(filepath).replace('\\\\', '/')
+    stat     = os.stat(filepath)
+    mimetype = guess_type(filepath)[0] or 'application/octet-stream'
+    if mimetype.startswith('text/'): mimetype += '; charset=UTF-8'
+    encodings = { e: os.stat(filepath + x).st_size for e, x in 
+                  [ ("br", ".br"), ("gzip", ".gz") ] 
+                  if args.deploy and isfile(filepath + x) }
+    return { "path": repr(path), "filepath": filepath, "asset": repr(( 
+        filepath, stat.st_size, mimetype, 
+        '"{}"'.format(manifest.hash(filepath)[:20]), int(stat.st_mtime), 
+        formatdate(stat.st_mtime, usegmt=True), encodings )) }
+
+
+def compress_file(filepath):
+    \""" write the compressed variants of a file that are worth serving \"""
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    for extension, compress in COMPRESSORS:
+        packed = compress(data)
+        if len(packed) < len(data) * 0.9: # not worth a header otherwise
+            with open(filepath + extension, 'wb') as f:
+                f.write(packed)
+        elif isfile(filepath + extension):
+            os.remove(filepath + extension)
+
+
+def precompress_assets(files):
+    \""" compress assets side by side, zlib and brotli release the gil \"""
+    stale = []
+    for filepath in files:
+        if splitext(filepath)[-1].lower() not in COMPRESSIBLE: continue
+        key = manifest.key( manifest.hash(filepath), 
+                            [ e for e, c in COMPRESSORS ] )
+        if not manifest.is_current("compress:" + filepath, key):
+            stale.append((filepath, key))
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        list(pool.map( compress_file, [ f for f, k in stale ] ))
+    PROFILER.count("files compressed", len(stale))
+    for filepath, key in stale:
+        manifest.record("compress:" + filepath, key, 
+            [ filepath + e for e, c in COMPRESSORS if isfile(filepath + e) ])
+
+
+def fingerprint_assets(assets):
+    \""" write the asset manifest app.py uses to serve fingerprinted names \"""
+    if not args.fingerprint:
+        if isfile("asset-manifest.json"): os.remove("asset-manifest.json")
+        return
+    fingerprint = lambda p, f: "{0}.{2}{1}".format(
+        *(splitext(p) + (manifest.hash(f)[:12],)) )
+    with open("asset-manifest.json", 'w') as f:
+        json.dump({ a["path"]: fingerprint(a["path"], a["filepath"]) 
+                    for a in assets }, f, indent=1, sort_keys=True)
+
+
+def write_nginx_config(routes):
+    \""" serve the static assets from nginx, and pass the rest on to app.py \"""
+    root    = join(args.path, "www") # where the build is once swapped in
+    quote   = lambda s: json.dumps(s, ensure_ascii=False)
+    assets  = { a["path"]: a["filepath"] for section in ASSET_ROUTES 
+                for tpl, a in routes[section] }
+    pages   = { v["path"]: v["page"] for tpl, v in routes["main_routes"] 
+                if tpl is STATIC_VIEW_TEMPLATE } # prerendered with -s
+    LOCATION = lambda p, f, c: ( NGINX_LOCATION_TEMPLATE, { "path": quote(p), 
+        "filepath": quote("/" + f), "cache_control": c } )
+
+    # names that can be served with new content revalidate every time
+    locations = [ LOCATION("/" + p, assets[h], "public, no-cache") 
+                  for p, h in sorted(pages.items()) ]
+    locations += [ LOCATION("/" + p, f, "public, no-cache") 
+                   for p, f in sorted(assets.items()) ]
+    if isfile("asset-manifest.json"):
+        with open("asset-manifest.json", 'r') as f:
+            locations += [ LOCATION( "/" + n, assets[p], 
+                "public, max-age=31536000, immutable" ) 
+                for p, n in sorted(json.load(f).items()) ]
+
+    live = join(root, "nginx.conf")
+    previous = None
+    if isfile(live):
+        with open(live, 'r') as f:
+            previous = f.read()
+    Template.populate(NGINX_CONF_TEMPLATE, 'nginx.conf', locations=locations, 
+        upstream_name="".join( c if c.isalnum() else "_" 
+                               for c in PROJECT_NAME ) + "_app",
+        upstream=args.upstream, server_name=args.server_name, 
+        root=quote(root))
+    with open('nginx.conf', 'r') as f:
+        if f.read() != previous:
+            print("nginx.conf changed, reload nginx to serve the new assets")
+
+
+def minify_html(html):
+    \""" 
+    Collapse whitespace and drop comments, leaving preformatted blocks, 
+    scripts, styles and conditional comments untouched. A comment takes the 
+    whitespace after it along only if there was whitespace before it.
+
+    >>> minify_html("<p>\\\\n    <!--[if lt IE 9]><br><![endif]-->\\\\n</p>")
+    '<p> <!--[if lt IE 9]><br><![endif]--> </p>'
+    >>> minify_html("<span>a</span> <!-- c --><span>b</span>")
+    '<span>a</span> <span>b</span>'
+    >>> minify_html("<span>a</span><!-- c -->\\\\n  <span>b</span>")
+    '<span>a</span> <span>b</span>'
+    >>> minify_html("a <!-- c -->\\\\n  b<!-- d --><pre> x\\\\n  y</pre>")
+    'a b<pre> x\\\\n  y</pre>'
+    \"""
+    return RE_HTML_MINIFY.sub( lambda m: m.group(1) or 
+        ("" if m.group(3) else " "), html ).strip()
+
+
+def head_elements(routes):
+    \""" markup for the placeholders in the views, made from the stylesheets, 
+        favicons and fonts the build generated \"""
+    paths  = lambda section: [ a["path"] for tpl, a in routes[section] ]
+    asset  = "{{{{asset('{}')}}}}".format
+    sizes  = lambda p: search(r'-(\\d+x\\d+)', p).group(1)
+    styles = [ p for p in paths("css_routes") if p.endswith(".css") ]
+    rank   = lambda e: list(FONT_PRELOADS).index(e)
+    fonts  = {}
+    for path in paths("font_routes"): # only the best format of each font
+        stem, ext = splitext(path)
+        if ext.lower() in FONT_PRELOADS and (stem not in fonts or 
+                rank(ext.lower()) < rank(fonts[stem][1])):
+            fonts[stem] = [ path, ext.lower() ]
+
+    favicons = []
+    for path in paths("favicon_routes"):
+        if match(r'(touch-icon|favicon)-\\d+x\\d+\\.png$', path):
+            favicons.append('<link rel="icon" type="image/png" sizes="{}" '
+                            'href="{}">'.format(sizes(path), asset(path)))
+        elif match(r'apple-touch-icon-\\d+x\\d+\\.png$', path):
+            favicons.append('<link rel="apple-touch-icon" sizes="{}" '
+                            'href="{}">'.format(sizes(path), asset(path)))
+        elif path == "apple-touch-icon.png":
+            favicons.append('<link rel="apple-touch-icon" href="{}">'.format(
+                asset(path) ))
+
+    # with the critical rules of a view inlined, its stylesheets can load 
+    # without blocking the first render
+    links = [ '<link rel="stylesheet" href="{}">'.format(asset(p)) 
+              for p in styles ]
+    stylesheets = [ '<link rel="preload" href="{}" as="font" type="{}" '
+                    'crossorigin>'.format(asset(p), FONT_PRELOADS[e]) 
+                    for p, e in sorted(fonts.values()) ]
+    if args.deploy and styles:
+        stylesheets += [ "% if critical_css(get('template')):", 
+                         "<style>{{!critical_css(get('template'))}}</style>" ]
+        stylesheets += [ '<link rel="preload" href="{}" as="style" '
+                         'onload="this.onload=null;this.rel=\\'stylesheet\\'">'
+                         .format(asset(p)) for p in styles ]
+        stylesheets += [ "<noscript>" + l + "</noscript>" for l in links ]
+        stylesheets += [ "% else:" ] + links + [ "% end" ]
+    else:
+        stylesheets += links
+    return { "stylesheets": stylesheets, "favicon_elements": favicons }
+
+
+def fill_placeholders(elements):
+    \""" place views as they are, unless they have placeholders to fill in \"""
+    def place(src, dst):
+        with open(src, 'r') as f:
+            source = f.read()
+        filled = RE_PLACEHOLDER.sub( lambda m: "\\n".join( m.group(1) + e 
+            for e in elements[m.group(2)] ) if m.group(2) in elements 
+            else m.group(0), source )
+        if filled == source:
+            return manifest.copy(src, dst)
+        key = manifest.key(filled)
+        if manifest.is_current("view placeholders:" + dst, key): return
+        if os.path.lexists(dst): os.remove(dst) # may be a link to the source
+        with open(dst, 'w') as f:
+            f.write(filled)
+        manifest.record("view placeholders:" + dst, key, [ dst ])
+    return place
+
+
+def view_markup(name, including=()):
+    \""" the markup of a view, with the views it includes or rebases on \"""
+    filepath = join("views", name)
+    if not isfile(filepath): filepath += ".tpl"
+    if name in including or not isfile(filepath): return ""
+    with open(filepath, 'r') as f:
+        source = f.read()
+    base = []
+    def expand(m):
+        if m.group(1) == "rebase": 
+            base.append(m.group(2))
+            return ""
+        return view_markup(m.group(2), including + (name,))
+    source = RE_VIEW_INCLUDE.sub(expand, source)
+    for layout in base:
+        source = RE_VIEW_BASE.sub( lambda m: source, 
+            view_markup(layout, including + (name,)) )
+    return source
+
+
+def css_rules(css):
+    \""" split css into (selector or at-rule, block) pairs, the blocks of 
+        rules like @media are css again. Statements have a block of None \"""
+    css = RE_CSS_COMMENT.sub("", css)
+    rules, depth, start, quote = [], 0, 0, None
+    for i, c in enumerate(css):
+        if quote:
+            if c == quote and css[i-1] != '\\\\': quote = None
+        elif c in '"\\'':
+            quote = c
+        elif c == '{':
+            if not depth: prelude, start = css[start:i].strip(), i + 1
+            depth += 1
+        elif c == '}' and depth:
+            depth -= 1
+            if not depth:
+                rules.append(( prelude, css[start:i] ))
+                start = i + 1
+        elif c == ';' and not depth:
+            rules.append(( css[start:i].strip(), None ))
+            start = i + 1
+    return rules
+
+
+def critical_rules(rules, page, fold):
+    \""" the rules matching an element in the first round trip of a page, 
+        given the (tags, classes, ids) in the whole page and in that part \"""
+    def matches(compound, tokens):
+        tag = match(r'[a-zA-Z][\\w-]*', compound)
+        return ( (not tag or tag.group(0).lower() in tokens[0]) and 
+                 set(findall(r'\\.([\\w-]+)', compound)) <= tokens[1] and
+                 set(findall(r'#([\\w-]+)', compound)) <= tokens[2] )
+    def selected(prelude):
+        while RE_CSS_PARENS.search(prelude): # :not(...), [type="..."] etc.
+            prelude = RE_CSS_PARENS.sub("", prelude)
+        for selector in prelude.split(","):
+            compounds = RE_CSS_COMPOUND.split(selector.strip())
+            if matches(compounds[-1], fold) and \\
+                    all(matches(c, page) for c in compounds[:-1]):
+                return True
+        return False
+
+    critical = []
+    for prelude, block in rules:
+        if block is None: continue # i.e. @charset, @import
+        if match(r'@(media|supports)\\b', prelude):
+            inner = critical_rules(css_rules(block), page, fold)
+            if inner: critical.append(prelude + "{" + inner + "}")
+        elif prelude.startswith("@font-face") or \\
+                (not prelude.startswith("@") and selected(prelude)):
+            critical.append(prelude + "{" + block.strip() + "}")
+    return "".join(critical)
+
+
+def extract_critical_css(views, stylesheets):
+    \""" write the css each view needs for what fits in the first round trip \"""
+    if not args.deploy or not stylesheets:
+        if isfile("critical-css.json"): os.remove("critical-css.json")
+        return
+    css = ""
+    for stylesheet in stylesheets:
+        with open(stylesheet, 'r', encoding="utf-8") as f:
+            css += f.read()
+    rules = css_rules(css)
+    tokens = lambda markup: (
+        { t.lower() for t in RE_MARKUP_TAG.findall(markup) },
+        { c for a in RE_MARKUP_CLASS.findall(markup) for c in a.split() 
+          if "{" not in c and "}" not in c },
+        set(RE_MARKUP_ID.findall(markup)) )
+    critical = {}
+    for name in views:
+        markup = view_markup(name)
+        body = max(markup.find("<body"), 0)
+        critical[name] = critical_rules( rules, tokens(markup), 
+            tokens(markup[body:body + CRITICAL_BYTES]) )
+    with open("critical-css.json", 'w') as f:
+        json.dump(critical, f, indent=1, sort_keys=True)
+
+
+def view_marked(source, marker):
+    with open(join("views", source), 'r') as f:
+        return bool(marker.search(f.read()))
+
+
+def export_view(name, source, output, key, defaults):
+    \""" render a view to a static html file, False if it must stay dynamic \"""
+    if view_marked(source, RE_DYNAMIC_VIEW): return False
+    if manifest.is_current("view:" + name, key): return True
+    if os.getcwd() not in sys.path: sys.path.insert(0, os.getcwd())
+    import bottle
+    bottle.TEMPLATES.clear()
+    bottle.BaseTemplate.defaults.update(defaults) # as app.py sets them
+    try:
+        html = bottle.template(name, request=bottle.request, template=name)
+    except Exception as exception: # most likely depends on the request
+        print("Serving view '{}' dynamically, could not render it: {}".format(
+            name, exception ))
+        return False
+    os.makedirs(dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        f.write(minify_html(html))
+    PROFILER.count("views rendered")
+    manifest.record("view:" + name, key, [ output ])
+    return True
+
+
+def migrate_views(routes):
+    place = fill_placeholders(head_elements(routes))
+    views = ([ ("", "load_root", "index") ] + 
+             [ ( splitext(r)[0],
+                 "load_" + splitext(r.split("/")[-1])[0].replace("-","_"),
+                 splitext(r.split("/")[-1])[0] 
+               ) for r in migrate_files("dev/views", "views", place) ])
+    sources = { splitext(f)[0]: f for f in os.listdir("views") }
+    extract_critical_css( sorted(set( n for p, m, n in views )), 
+        [ a["filepath"] for tpl, a in routes["css_routes"] 
+          if a["filepath"].endswith(".css") ] )
+    MAIN_VIEW = lambda p, m, n: \\
+        MAIN_ROUTE(p, m, n, not view_marked(sources[n], RE_NOCACHE_VIEW))
+    if not args.static:
+        return [ MAIN_VIEW(*v) for v in views ], []
+
+    # prerender the views, any view can include any other one
+    data = { f: json.load(open(f)) if isfile(f) else {} 
+             for f in [ "asset-manifest.json", "critical-css.json" ] }
+    defaults = { 
+        "asset": lambda p: "/" + data["asset-manifest.json"].get(p, p),
+        "critical_css": lambda v: data["critical-css.json"].get(v, "") }
+    key = manifest.key( manifest.hash("bottle.py"), sorted( 
+        (f, manifest.hash(join("views", f))) for f in sources.values() ), data )
+    main_routes, html_routes = [], {}
+    for path, method_name, name in views:
+        page = (path or "index") + ".html" # '/' and '/index' share a page
+        if export_view( name, sources[name], join("static/html", page), key, 
+                        defaults ):
+            main_routes.append(STATIC_VIEW(path, method_name, page))
+            html_routes[page] = STATIC_ROUTE(page, page, "static/html")
+        else:
+            main_routes.append(MAIN_VIEW(path, method_name, name))
+    return main_routes, list(html_routes.values())
 
 
 def get_api_routes(): # TODO: multiple file support here?
@@ -481,9 +2076,102 @@ def get_api_routes(): # TODO: multiple file support here?
         return f.read()
 
 
-def migrate_static_files(source, destination):
+def migrate_static_files(source, destination, place=None):
     return [ STATIC_ROUTE(r, r.split("/")[-1], destination)
-                for r in migrate_files(source, destination) ]
+                for r in migrate_files(source, destination, place) ]
+
+
+def image_variants(name):
+    \""" file name and imagemagick options of each version made of an image \"""
+    base, ext = splitext(name)
+    lossless  = ext.lower() == ".png"
+    options   = ["-strip"] + ( [ "-define", "png:compression-level=9" ] 
+        if lossless else [ "-quality", str(args.image_quality), 
+                           "-interlace", "Plane", "-sampling-factor", "4:2:0" ] )
+    webp      = ["-strip"] + ( [ "-define", "webp:lossless=true" ] 
+        if lossless else [ "-quality", str(args.image_quality) ] )
+    sizes     = [ (name, []) ] + [ ( "{}-{}w{}".format(base, w, ext), 
+                  [ "-resize", "{}x>".format(w) ] ) for w in args.image_widths ]
+    return ( [ (n, r + options) for n, r in sizes 
+               if r or args.optimize_images ] +
+             [ (n + ".webp", r + webp) for n, r in sizes if args.webp ] )
+
+
+def render_image(src, digest, options, ext):
+    cached = join(CACHE_DIR, "img", "{}-{}{}".format( 
+        digest, manifest.key(options)[:16], ext ))
+    if isfile(cached): # keyed on image content hash and options
+        return cached
+    if not isdir(dirname(cached)): os.makedirs(dirname(cached), exist_ok=True)
+    tmp = "{}.{}.tmp{}".format(splitext(cached)[0], os.getpid(), ext)
+    sCall(*( ["convert", src] + options + [tmp] ))
+    if not isfile(tmp):
+        raise Exception("Imagemagick failed to convert " + src)
+    os.replace(tmp, cached)
+    PROFILER.count("images converted")
+    return cached
+
+
+def generate_images():
+    pending = {} # images the pipeline makes versions of, by output path
+    def place(src, dst):
+        if splitext(dst)[-1].lower() in PIPELINE_IMAGES and \\
+                image_variants(basename(dst)):
+            pending[dst] = src
+            if args.optimize_images: return # written by the pipeline
+        manifest.copy(src, dst)
+    routes = migrate_static_files("res/img", "static/img", place)
+
+    # convert the images whose content or settings changed, side by side
+    stale = []
+    for dst, src in pending.items():
+        variants = image_variants(basename(dst))
+        key = manifest.key( manifest.hash(src), variants, 
+            manifest.tool_version("convert"), manifest.link )
+        if not manifest.is_current("image:" + dst, key):
+            stale.append((dst, src, key, variants))
+    jobs = [ (src, manifest.hash(src), options, splitext(name)[-1]) 
+             for dst, src, key, variants in stale for name, options in variants ]
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        renders = iter(list(pool.map(lambda j: render_image(*j), jobs)))
+    for dst, src, key, variants in stale:
+        outputs = [ join("static/img", name) for name, options in variants ]
+        for output in outputs:
+            render = next(renders)
+            if output == dst and os.path.getsize(render) >= \\
+                    os.path.getsize(src): # recompressing did not pay off
+                render = src
+            stage_file(render, output, manifest.link)
+        manifest.record("image:" + dst, key, outputs)
+
+    # the other versions are served next to the image they were made from
+    for tpl, values in list(routes):
+        dst = values["filepath"]
+        if dst in pending:
+            routes += [ STATIC_ROUTE( values["path"][:-len(basename(dst))] + 
+                            name, name, "static/img" ) 
+                        for name, options in image_variants(basename(dst)) 
+                        if name != basename(dst) ]
+    return routes
+
+
+def render_favicon(favicon_tpl, digest, res):
+    cached = join(CACHE_DIR, "favicon", "{}-{}.png".format(digest, res))
+    if isfile(cached): # renders are keyed on svg content hash and size
+        return cached
+    if not isdir(dirname(cached)): os.makedirs(dirname(cached), exist_ok=True)
+    tmp = "{}.{}.tmp".format(cached, os.getpid())
+    if manifest.tool_version("inkscape").startswith("Inkscape 1"):
+        sCall("inkscape", "-o", tmp, "--export-type=png", 
+              "-w", res, "-h", res, favicon_tpl)
+    else:
+        sCall("inkscape", "-z", "-e", tmp, "-w", res, "-h", res, favicon_tpl)
+    if not isfile(tmp):
+        raise Exception("Inkscape failed to render favicon at {0}x{0}".format(
+            res ))
+    os.replace(tmp, cached)
+    PROFILER.count("favicons rendered")
+    return cached
 
 
 def generate_favicon_resources(): # TODO: adhere to ! ~ rules?
@@ -497,21 +2185,30 @@ def generate_favicon_resources(): # TODO: adhere to ! ~ rules?
     fav_res     = [ "16", "32", "96", "160", "196", "300" ]
     android_res = [ "192" ]
     apple_res   = [ "57", "76", "120", "152", "180" ] # add to head backwards
-    if not isdir("static/favicon"): os.makedirs("static/favicon")
-
-    # generate favicon resources
-    for res in (list(set(ico_res) | set(fav_res)) + android_res + apple_res):
-        # TODO: add exception checking
-        if res in android_res: path = fav_path(and_tpl(res))
-        elif res in apple_res: path = fav_path(app_tpl(res))
-        else:                  path = fav_path(fav_tpl(res))
-        # TODO: this wont work if there are android and ios duplicates
-        sCall("inkscape", "-z", "-e", path, "-w", res, "-h", res, favicon_tpl)
-    # TODO: theres gotta be a cleaner way than this (bet i can get it on 1 line)
-    sCall( *(["convert"] + [fav_path(fav_tpl(r)) for r in ico_res] + 
-             [fav_path("favicon.ico")]) )
-    for res in [ r for r in ico_res if r not in fav_res ]:
-        os.remove(fav_path(fav_tpl(res)))
+    os.makedirs("static/favicon", exist_ok=True)
+    # output path for every generated image mapped to its resolution, so 
+    # sizes shared between the android, apple and favicon sets work out
+    targets = dict( [ (fav_path(fav_tpl(r)), r) for r in fav_res ] + 
+                    [ (fav_path(and_tpl(r)), r) for r in android_res ] + 
+                    [ (fav_path(app_tpl(r)), r) for r in apple_res ] + 
+                    [ (fav_path(pra_tpl(r)), r) for r in apple_res ] )
+    digest = manifest.hash(favicon_tpl)
+    key = manifest.key( digest, 
+        manifest.tool_version("inkscape"), manifest.tool_version("convert"),
+        manifest.link, ico_res, fav_res, android_res, apple_res )
+
+    # generate favicon resources, rendering each distinct size only once
+    if not manifest.is_current("favicons", key):
+        sizes = sorted(set(ico_res) | set(targets.values()), key=int)
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            renders = dict(zip(sizes, pool.map(
+                lambda r: render_favicon(favicon_tpl, digest, r), sizes )))
+        for path, res in targets.items():
+            stage_file(renders[res], path, manifest.link)
+        sCall( *(["convert"] + [renders[r] for r in ico_res] + 
+                 [fav_path("favicon.ico")]) )
+        manifest.record("favicons", key, 
+                        list(targets) + [ fav_path("favicon.ico") ])
     
     # return routes for generated favicon resources
     fav_route = lambda f:   STATIC_ROUTE(f, f, "static/favicon")
@@ -526,73 +2223,332 @@ def generate_favicon_resources(): # TODO: adhere to ! ~ rules?
 
 def generate_stylesheets(): # TODO: adhere to ! ~ rules?
     dev_path   = join( SCRIPT_DIR, "dev/sass" )
-    is_sass    = lambda f: splitext(f)[-1].lower() in ['.scss', '.sass']
     is_mixin   = lambda f: match(r'.*mixins?$', splitext(f)[0].lower())
-    get_import = lambda p: [ join( relpath(r, dev_path), f ) 
-                             for r, d, fs in os.walk( join(dev_path, p) ) 
-                             for f in fs if is_sass(f) ]
-    if not isdir("static/css"): os.makedirs("static/css")
-
-    # generate _all.scss file from existing sass resources
-    # TODO: this will only work for the default sass directory setup
-    with open( join( dev_path, '_all.scss' ), 'w') as f:
-        f.write('\\n'.join( # probably not the most efficient way
-            [ '@import "{}";'.format(path.replace('\\\\', '/')) for path in 
-                ( # mixins and global variables must be imported first
-                    # modules
-                    [ f for f in get_import('modules') ]
-                    # vendor mixins 
-                  + [ f for f in get_import('vendor') if is_mixin(f) ]
-                    # all other vendor files
-                  + [ f for f in get_import('vendor') if not is_mixin(f) ]
-                    # partials (comment out this line for manually selection)
-                  + [ f for f in get_import('partials') ]
-                ) 
-            ] ) 
-        )
+    os.makedirs("static/css", exist_ok=True)
+    graph = SassGraph(dev_path, SASS_GRAPH)
+    graph.scan()
+
+    # generate _all.scss file from the partials in any directory, mixins and 
+    # global variables must be imported first, so modules come first, then 
+    # mixins, then the rest, leaving partials for last
+    rank = lambda p: ( 0 if p.startswith("modules/") else 
+                       3 if p.startswith("partials/") else 
+                       1 if is_mixin(basename(p)) else 2 )
+    all_scss = '\\n'.join( '@import "{}";'.format(path) 
+                            for path in graph.partials(rank) )
+    if not isfile( join(dev_path, '_all.scss') ) or \\
+            open( join(dev_path, '_all.scss') ).read() != all_scss:
+        with open( join( dev_path, '_all.scss' ), 'w') as f:
+            f.write(all_scss) # left alone if unchanged to not wake watchers
+        graph.scan()
+    stylesheets = [ splitext(s)[0] for s in graph.stylesheets() ]
+    output = lambda s: "static/css/{}.{}css".format(
+        s, "min." if args.deploy else "" )
 
     # use sass command line tool to generate stylesheets
-    stylesheets = [ splitext(f)[0] for f in os.listdir(dev_path) 
-                    if is_sass(f) and not f.startswith('_') ]
     sass_path = relpath(dev_path, os.getcwd()).replace('\\\\', '/')
-    if args.deploy:
-        for s in stylesheets:
-            sCall("sass", sass_path+"/"+s+".scss", "static/css/"+s+".min.css", 
-                  "-t", "compressed", "--sourcemap=none", "-C")
-        os.remove( join(dev_path, "_all.scss") )
+    if args.deploy or args.watch:
+        # a stylesheet only depends on the files it imports, directly or not
+        options = ["-t", "compressed", "--sourcemap=none"] if args.deploy \\
+                  else []
+        stale = [ (s, manifest.key(manifest.tool_version("sass"), options, 
+                      sorted( (d, manifest.hash(join(dev_path, d))) for d in 
+                              graph.dependencies(s + ext) ))) 
+                  for s, ext in map(splitext, graph.stylesheets()) ]
+        stale = [ (s, k) for s, k in stale 
+                  if not manifest.is_current("stylesheet:"+s, k) ]
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            list(pool.map( lambda s: sCall(*( ["sass", sass_path+"/"+s[0]+
+                ".scss", output(s[0])] + options + ["-C"] )), stale ))
+        PROFILER.count("stylesheets compiled", len(stale))
+        for s, key in stale:
+            if not isfile(output(s)):
+                raise Exception("Sass failed to compile " + output(s))
+            manifest.record("stylesheet:"+s, key, [ output(s) ])
+        if args.deploy: os.remove( join(dev_path, "_all.scss") )
     else: # TODO: if dev mode add sass maps to routes
-        Template.populate(WATCH_SASS_SCRIPT, '../dev/sass/watch.py')
-        sPopen( 'python', '../dev/sass/watch.py', *stylesheets )
-        sleep(3) # delay so the stylesheets have time to be created
-
-    # return css routes from generated stylesheets
-    return [ STATIC_ROUTE(f, f, "static/css") for f in os.listdir("static/css")]
-
-
-
+        ready_file = join(dev_path, WATCH_READY)
+        if isfile(ready_file): os.remove(ready_file)
+        Template.populate(WATCH_SASS_SCRIPT, join(dev_path, 'watch.py'), 
+                          ready_file=WATCH_READY)
+        watcher = sPopen( 'python', join(dev_path, 'watch.py'), 
+                          abspath("static/css"), *stylesheets )
+        # wait for the initial compile rather than guessing how long it takes
+        while not isfile(ready_file):
+            if watcher.poll() is not None:
+                raise Exception( "Sass failed to compile the stylesheets "
+                    "(exit status {})".format(watcher.returncode) )
+            sleep(0.05)
+
+    # return css routes from the stylesheets there are now, www can still 
+    # hold the output of ones that were removed since
+    return [ STATIC_ROUTE(basename(output(s)), basename(output(s)), 
+                          "static/css") for s in stylesheets ]
+
+
+def script_requires(path):
+    \""" the modules a script pulls in, with typescript reference paths or 
+        '//= require' ('#= require' in coffeescript) lines \"""
+    with open(path, 'r', encoding="utf-8") as f:
+        names = RE_SCRIPT_REQUIRE.findall(f.read())
+    requires = []
+    for name in names:
+        base = normpath(join(dirname(path), name))
+        for candidate in [ base ] + [ base + e for e in SCRIPT_TYPES ]:
+            if isfile(candidate):
+                if not candidate.endswith(".d.ts"): # only declares types
+                    requires.append(candidate)
+                break
+    return requires
+
+
+def script_bundle(entry):
+    \""" an entry point and every module it requires, dependencies first \"""
+    order, visiting = [], set()
+    def visit(path):
+        if path in order or path in visiting: return
+        visiting.add(path)
+        for required in script_requires(path): visit(required)
+        order.append(path)
+    visit(entry)
+    return order
+
+
+def compile_script(src, digest):
+    compiler = SCRIPT_COMPILERS[splitext(src)[-1].lower()]
+    cached = join(CACHE_DIR, "js", "{}-{}.js".format( digest, manifest.key( 
+        compiler("", ""), manifest.tool_version(compiler("", "")[0]) )[:16] ))
+    if isfile(cached): # keyed on module content hash and compiler
+        return cached
+    if not isdir(dirname(cached)): os.makedirs(dirname(cached), exist_ok=True)
+    tmp = mkdtemp(dir=dirname(cached))
+    try:
+        sCall(*compiler(src, tmp))
+        output = join(tmp, splitext(basename(src))[0] + ".js")
+        if not isfile(output):
+            raise Exception("Failed to compile " + src)
+        os.replace(output, cached)
+    finally:
+        rmtree(tmp)
+    PROFILER.count("scripts compiled")
+    return cached
+
+
+def bundle_script(modules, output, minify):
+    \""" join compiled modules into one script, minified by terser if asked \"""
+    with open(output + ".tmp", 'w', encoding="utf-8") as f:
+        for module in modules:
+            with open(module, 'r', encoding="utf-8") as m:
+                f.write(m.read().rstrip() + "\\n;\\n")
+    if minify:
+        sCall( "terser", output + ".tmp", "--compress", "--mangle", 
+               "--output", output + ".min.tmp" )
+        os.remove(output + ".tmp")
+        if not isfile(output + ".min.tmp"):
+            raise Exception("Terser failed to minify " + output)
+        os.replace(output + ".min.tmp", output)
+    else:
+        os.replace(output + ".tmp", output)
+
+
+def generate_scripts():
+    dev_path = join( SCRIPT_DIR, "dev/ts" )
+    if not isdir(dev_path): return []
+    os.makedirs("static/js", exist_ok=True)
+    compiler = lambda m: SCRIPT_COMPILERS.get(splitext(m)[-1].lower())
+    output   = lambda e: "static/js/{}.{}js".format( 
+        splitext(e)[0], "min." if args.deploy else "" )
+    minify   = bool(args.deploy and which("terser"))
+    entries  = sorted( f for f in os.listdir(dev_path) # ! leaves a file out
+                       if not f.startswith(('_', '!')) 
+                       and splitext(f)[-1].lower() in SCRIPT_TYPES
+                       and not f.endswith(".d.ts") )
+
+    # each top level script is an entry point, bundled with what it requires
+    bundles = { e: script_bundle(join(dev_path, e)) for e in entries }
+    stale = []
+    for entry, modules in bundles.items():
+        key = manifest.key( minify and manifest.tool_version("terser"), 
+            [ ( relpath(m, dev_path), manifest.hash(m), compiler(m) and 
+                manifest.tool_version(compiler(m)("", "")[0]) ) 
+              for m in modules ] )
+        if not manifest.is_current("script:" + entry, key):
+            stale.append((entry, key))
+
+    # compile every module once, then bundle the entry points side by side
+    modules = sorted({ m for e, k in stale for m in bundles[e] if compiler(m) })
+    digests = [ manifest.hash(m) for m in modules ]
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        compiled = dict(zip( modules, pool.map(compile_script, modules, digests) ))
+        list(pool.map( lambda e: bundle_script( [ compiled.get(m, m) for m in 
+            bundles[e] ], output(e), minify ), [ e for e, k in stale ] ))
+    PROFILER.count("scripts bundled", len(stale))
+    for entry, key in stale:
+        manifest.record("script:" + entry, key, [ output(entry) ])
+    return [ STATIC_ROUTE(basename(output(e)), basename(output(e)), "static/js") 
+             for e in entries if not e.startswith('~') ] # built, but not routed
+
+
+
+PROFILER.enabled = bool(args.profile)
 os.chdir(args.path)
-if isdir('www'): rmtree('www')
-os.makedirs("www")
-os.chdir("www") # all operations will happen relative to www
+args.path = os.getcwd()
+if args.rollback: # never forward again, to a build rolled back from
+    builds = [ b for b in previous_builds() if not basename(b).startswith("0-") ]
+    if not builds: exit("There is no previous build to roll back to")
+    replace_directory(builds[0], "www", retired_build(oldest=True))
+    reload_app()
+    exit(0)
+
+if args.deploy: # the live site is left alone until the build is complete
+    if isdir(STAGING_DIR): rmtree(STAGING_DIR) # left over by a failed build
+    builds = previous_builds()
+    if args.clean or not isdir("www"):
+        os.makedirs(STAGING_DIR)
+    elif builds and len(builds) > args.keep: # the spare one beyond --keep, 
+        os.rename(builds[-1], STAGING_DIR)   # only its changes are rebuilt
+    else:
+        with PROFILER.stage("copy live site"):
+            copytree("www", STAGING_DIR, symlinks=True, 
+                     copy_function=copy_live_file)
+    os.chdir(STAGING_DIR)
+else:
+    if args.clean and isdir('www'): rmtree('www')
+    if not isdir('www'): os.makedirs("www")
+    os.chdir("www") # all operations will happen relative to www
+manifest = BuildManifest(".manifest.json", args.clean, args.link)
 
 # import bottle framework
 bottle_url = ( "https://raw.githubusercontent.com/"
                 "bottlepy/bottle/master/bottle.py" )
-with urlopen(bottle_url) as response, open('bottle.py', 'wb') as f:
-    copyfileobj(response, f)
+def fetch_bottle(): # fetch answers from the cache unless bottle.py changed
+    key = manifest.key(bottle_url, int(time() // DOWNLOAD_TTL))
+    if not manifest.is_current("bottle", key):
+        fetch(bottle_url, 'bottle.py', args.offline or None)
+        manifest.record("bottle", key, [ "bottle.py" ])
+
+
+def index_assets(routes):
+    \""" the routes of app.py, with everything it needs to serve each asset \"""
+    indexed = { s: routes[s] for s in [ "main_routes", "api_routes" ] }
+    for section in ASSET_ROUTES: # entries see the compressed variants
+        indexed[section] = [ (tpl, asset_index_entry(**values)) 
+                             for tpl, values in routes[section] ]
+    return indexed
+
+
+def served_files(routes):
+    \""" the routes without the file metadata, which the development server 
+        reads from the disk on every request anyway \"""
+    return dict( routes, **{ section: [ (tpl, values["filepath"]) 
+        for tpl, values in routes[section] ] for section in ASSET_ROUTES } )
+
+
+def asset_fingerprints():
+    \""" the asset manifest, which app.py only loads when it starts \"""
+    if not isfile("asset-manifest.json"): return None
+    with open("asset-manifest.json", 'r') as f:
+        return f.read()
+
 
 # generate app.py
 # TODO: hide headers if there are no routes for that section?
-Template.populate(APP_PY_TEMPLATE, 'app.py', 
-    doc_string="",
-    main_routes=migrate_views(),
-    api_routes=get_api_routes(),
-    static_routes=migrate_static_files("res/static", "static"),
-    favicon_routes=generate_favicon_resources(),
-    image_routes=migrate_static_files("res/img", "static/img"),
-    font_routes=migrate_static_files("res/font", "static/font"),
-    css_routes=generate_stylesheets(),
-    js_routes="" )
+def build_routes():
+    \""" run the stages of the build, each as soon as its inputs are made \"""
+    tasks    = TaskGraph(args.tasks)
+    sections = [ s for s in ASSET_ROUTES if s != "html_routes" ]
+    assets   = lambda sections: [ r[1] for section in sections 
+                                  for r in tasks.results[section] ]
+    tasks.add("fetch bottle.py", fetch_bottle, outputs=[ "bottle.py" ])
+    tasks.add("get_api_routes", get_api_routes, outputs=[ "api_routes" ])
+    tasks.add("migrate_static_files res/static", lambda: 
+        migrate_static_files("res/static", "static"), 
+        outputs=[ "static_routes" ])
+    tasks.add("generate_favicon_resources", generate_favicon_resources, 
+        outputs=[ "favicon_routes" ])
+    tasks.add("generate_images", generate_images, outputs=[ "image_routes" ])
+    tasks.add("migrate_static_files res/font", lambda: 
+        migrate_static_files("res/font", "static/font"), 
+        outputs=[ "font_routes" ])
+    tasks.add("generate_stylesheets", generate_stylesheets, 
+        outputs=[ "css_routes" ])
+    tasks.add("generate_scripts", generate_scripts, outputs=[ "js_routes" ])
+    tasks.add("fingerprint_assets", lambda: # views link the assets with them
+        fingerprint_assets(assets(sections)), 
+        inputs=sections, outputs=[ "asset-manifest.json" ])
+    tasks.add("migrate_views", lambda: migrate_views(tasks.results), 
+        inputs=[ "bottle.py", "asset-manifest.json", "favicon_routes", 
+                 "font_routes", "css_routes" ], 
+        outputs=[ "main_routes", "html_routes" ])
+    if args.deploy:
+        tasks.add("precompress_assets", lambda: precompress_assets( 
+            [ a["filepath"] for a in assets(ASSET_ROUTES) ]), 
+            inputs=ASSET_ROUTES, outputs=[ "compressed assets" ])
+    if args.nginx:
+        tasks.add("write_nginx_config", lambda: 
+            write_nginx_config(tasks.results), 
+            inputs=ASSET_ROUTES + [ "main_routes", "asset-manifest.json" ], 
+            outputs=[ "nginx.conf" ])
+    tasks.add("index assets", lambda: index_assets(tasks.results), 
+        inputs=ASSET_ROUTES + [ "main_routes", "api_routes", 
+                                "compressed assets" ], 
+        outputs=[ "routes" ])
+    return tasks.run()["routes"]
+
+try:
+    routes = build_routes()
+except Exception as exception: # a deployment build is thrown away, while a 
+                               # development build is picked up next time
+    fatal_exception(exception, "A build stage failed", args.deploy)
+with PROFILER.stage("write app.py"):
+    Template.populate(APP_PY_TEMPLATE, 'app.py', doc_string="", **routes)
+PROFILER.call("save manifest", manifest.save) # removes outputs no longer made
+if args.package: # and keep the hashes of the packaged files for next time
+    PROFILER.call("package site", package_site, args.package)
+    manifest.save()
+if args.deploy:
+    with PROFILER.stage("swap in build"):
+        os.chdir(args.path)
+        replace_directory(STAGING_DIR, "www", retired_build())
+        os.chdir("www")
+    reload_app()
+    # the new build is live by now, exiting waits for the removal to finish, 
+    # one build more than --keep is left to recycle as the next staging tree
+    remove_in_background(*previous_builds()[max(args.keep, 0) + 1:])
+if args.profile: 
+    PROFILER.save(args.profile)
+    print("Critical path: " + " > ".join( "{} ({:.2f}s)".format(*t) 
+                                         for t in PROFILER.critical_path ))
+
+# rebuild on changes, every stage skips the work whose inputs are unchanged
+if args.watch:
+    watcher = FileWatcher( [ join(SCRIPT_DIR, "dev"), join(SCRIPT_DIR, "res") ],
+        lambda n: n.startswith('.') or n in [ "_all.scss", "watch.py" ] )
+    print("Watching for changes (press Ctrl+C to stop)")
+    try:
+        while True:
+            changes = watcher.wait()
+            try:
+                manifest = BuildManifest(".manifest.json", link=args.link)
+                fingerprints = asset_fingerprints()
+                latest = build_routes()
+                # only touch app.py if the routes differ, as rewriting it 
+                # restarts the development server
+                changed = latest != routes if args.deploy else \\
+                          served_files(latest) != served_files(routes) or \\
+                          asset_fingerprints() != fingerprints
+                if changed:
+                    Template.populate(APP_PY_TEMPLATE, 'app.py', 
+                                      doc_string="", **latest)
+                    routes = latest
+                manifest.save()
+                if args.deploy: reload_app()
+                if args.profile: PROFILER.save(args.profile)
+                print("Rebuilt after {} change(s)".format(len(changes)))
+            except Exception as exception: # keep watching, it may get fixed
+                print("Rebuild failed: ", exception)
+    except KeyboardInterrupt:
+        pass
 """ )
 
 
@@ -602,193 +2558,231 @@ Template.populate(APP_PY_TEMPLATE, 'app.py',
 ################################################################################
 
 import sys 
-import time
-import urllib.request, shutil
-import errno, re
+import re, shutil
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join, isdir, isfile, splitext, abspath
 
-SCRIPT_DIR     = os.getcwd()
-PROJECT_DIR    = os.path.join(os.path.abspath(args.path), args.name)
 RE_USER_ACCEPT = re.compile(r'y(?:es|up|eah)?$', re.IGNORECASE)
 RE_USER_DENY   = re.compile(r'n(?:o|ope|ada)?$', re.IGNORECASE)
+IMAGE_TYPES    = [ '.png', '.jpg', '.jpeg', '.gif' ]
+FONT_TYPES     = [ '.eot', '.ttf', '.woff' ]
 
 
-def fatal_exception(exception, message="", cleanup=True):
-    print("*******SCRIPT FAILED*******")
-    if (message): print(message)
-    print("Exception: ", exception)
-    os.chdir(args.path)
-    os.remove("overrides.py")
-    sys.exit(1)
-    
-    if (cleanup):
-        try:
-            shutil.rmtree(args.name)
-        except Exception as e:
-            print(e)
-    sys.exit(1)
-
-
-def non_fatal_exception(exception, message, *args):
-    while 1:
-        response = input(message)
-        if (RE_USER_ACCEPT.match(response)):
-            return
-        if (RE_USER_DENY.match(response)):
-            fatal_exception(exception, "Script canceled by user", *args)
+class ProjectError(Exception):
+    """ a step of creating a project failed, the cause is the exception """
 
 
+def populate_sass_resources(directory, log=print, offline=None):
+    """ fetch the vendor sass files, the way update.py in the project does """
+    def populate(resource):
+        name, url = resource
+        try:
+            downloads.fetch(url, join(directory, name), offline)
+            log("Successfully populated '{}'".format(name))
+        except Exception as e:
+            message = "Could not populate resource" \
+                if not (isfile(join(directory, name))) \
+                else "Unable to update resource"
+            log("{}: {}\n  from url: {}\nException: {}".format(
+                message, name, url, e ) )
+    with ThreadPoolExecutor(max_workers=len(SASS_RESOURCES)) as pool:
+        list(pool.map(populate, SASS_RESOURCES))
+
+
+def import_resources(directory, resource_paths, jobs=None, profiler=None):
+    """ copy files, and the files in directories, into the res directory of a 
+        project, sorted into img, font and static by type """
+    resources = []
+    for resource_path in resource_paths:
+        resource_path = abspath(resource_path)
+        if isfile(resource_path):
+            resources.append(resource_path)
+        elif isdir(resource_path):
+            for root, dirs, files in os.walk(resource_path):
+                for filename in files:
+                    resources.append(join(root, filename))
+    # an svg with the same name as a font file is a font too
+    font_stems = { splitext(resource)[0] for resource in resources
+                   if splitext(resource)[-1].lower() in FONT_TYPES }
+
+    def destination(resource):
+        stem, ext = splitext(resource)
+        if ext.lower() == '.svg':
+            folder = 'font' if stem in font_stems else 'img'
+        elif ext.lower() in IMAGE_TYPES:
+            folder = 'img'
+        elif ext.lower() in FONT_TYPES:
+            folder = 'font'
+        else:
+            folder = 'static'
+        return join(directory, folder, os.path.split(resource)[-1])
+
+    # the last resource given with a name wins, as when copied in order
+    targets = { destination(resource): resource for resource in resources }
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+        list(pool.map( lambda t: shutil.copy(t[1], t[0]), targets.items() ))
+    if profiler: profiler.count("resources imported", len(targets))
+
+
+def create_project(name="untitled", path=".", favicon=None, resources=None, 
+                   jobs=None, profile=None, confirm=None, log=print, 
+                   offline=None):
+    """
+    Create the project for a new website at path/name, replacing any project 
+    already there once the new one is complete, and return its directory. 
+    Relative paths are taken from the current working directory, which is 
+    left alone, so projects can be created side by side from threads. 
+
+    A favicon that can not be imported is passed to confirm(message), and 
+    the project is only created without it if confirm returns True. Progress 
+    is reported through log (None for quiet), and a step that fails raises 
+    ProjectError once the partly created project has been removed.
+    """
+    log       = log or (lambda message: None)
+    profiler  = Profiler()
+    profiler.enabled = bool(profile)
+    path      = abspath(path)
+    project   = join(path, name)
+    build     = project + ".staging" # moved into place once complete
+    populate  = lambda template, filepath, **kwargs: \
+        Template.populate(template, join(build, filepath), **kwargs)
+
+    def step(message):
+        log(message)
+        profiler.step(message)
+
+    def fail(exception, message, cleanup=True):
+        if cleanup: # an existing project is only replaced by a complete one
+            shutil.rmtree(build, True)
+        raise ProjectError(message) from exception
+
+
+    step("Creating folder for new project")
+    if not isdir(path):
+        fail(FileNotFoundError(path), "Invalid path provided", False)
+    if isdir(build): # left over by a failed run
+        # TODO: add ability to update an already existing project
+        shutil.rmtree(build)
+    try:
+        os.makedirs(build)
+    except OSError as exception:
+        fail(exception, "Could not create project folder", False)
 
-print("Creating folder for new project")
-try:
-    args.path = os.path.abspath(args.path)
-    os.chdir(args.path)
-except OSError as exception:
-    fatal_exception(exception, "Invalid path provided", False)
 
-try:
-    os.makedirs(args.name)
-except OSError as exception:
-    # TODO: add ability to update an already existing project
-    if (exception.errno == errno.EEXIST): 
-        shutil.rmtree(args.name)
-        os.makedirs(args.name)
-        #non_fatal_exception(exception,
-        #    "Folder already exists at \'{}\' ".format(os.getcwd())    + 
-        #    "with the desired project name. Do you wish to proceed? " +
-        #    "(script will use this folder for the project)? [yes/no]", False)
-    else:
-        fatal_exception(exception, "Could not create project folder", False)
+    step("Building out directory structure for the project")
+    try:
+        for directory in [ "dev/ts", "dev/py", "dev/sass/modules", 
+                           "dev/sass/partials", "dev/sass/vendor", 
+                           "dev/views", "res/font", "res/img", "res/static" ]:
+            os.makedirs(join(build, directory))
+    except OSError as exception:
+        fail(exception, "Could not build project directory structure")
 
 
+    step("Setting up python resources")
+    try:
+        populate(ROUTES_TEMPLATE, 'dev/py/routes.py')
+    except Exception as exception:
+        fail(exception, "Could not create routes file")
 
-print("Building out directory structure for the project")
-try:
-    os.chdir(PROJECT_DIR)
-    os.makedirs("dev/ts")
-    os.makedirs("dev/py")
-    os.makedirs("dev/sass/modules")
-    os.makedirs("dev/sass/partials")
-    os.makedirs("dev/sass/vendor")
-    os.makedirs("dev/views")
-    os.makedirs("res/font")
-    os.makedirs("res/img")
-    os.makedirs("res/static")
-except OSError as exception:
-    fatal_exception(exception, "Could not build project directory structure")
-
-
-
-print("Setting up python resources")
-try:
-    os.chdir(os.path.join(PROJECT_DIR, 'dev/py'))
-    Template.populate(ROUTES_TEMPLATE, 'routes.py')
-except Exception as exception:
-    fatal_exception(exception, "Could not create routes file")
 
+    step("Creating sass scripts and pulling in resources")
+    try:
+        populate(STYLES_SASS_TEMPLATE, 'dev/sass/styles.scss')
+        populate(BASE_PARTIAL_SASS_TEMPLATE, 'dev/sass/partials/_base.scss')
+        populate(BASE_MODULE_SASS_TEMPLATE, 'dev/sass/modules/_base.scss')
+    except Exception as exception:
+        fail(exception, "Could not build sass project")
 
+    try:
+        populate(UPDATE_SASS_TEMPLATE, 'dev/sass/vendor/update.py', 
+            download_str=DOWNLOADS, resources=[ (SASS_RESOURCE_TEMPLATE, { 
+                "name": n, "host": u[:u.index("/", 8) + 1], 
+                "path": u[u.index("/", 8) + 1:] }) for n, u in SASS_RESOURCES ])
+        # so that sass can properly be compiled when site is built
+        with profiler.stage("update sass resources"):
+            log("Updating external sass resources")
+            populate_sass_resources( join(build, 'dev/sass/vendor'), 
+                                     log, offline )
+    except Exception as exception:
+        fail(exception, "Could not pull in external sass resources")
+
+
+    step("Creating default views for bottle project")
+    try:
+        populate(HEAD_TEMPLATE, 'dev/views/~head.tpl')
+        populate(INDEX_TEMPLATE, 'dev/views/index.tpl', 
+            title=name, 
+            description="Welcome to {}!".format(name) )
+    except Exception as exception:
+        fail(exception, "Could not build default views")
+
+
+    step("Populating project resources")
+    try: # TODO: add checking if image doesn't meet requirements
+        if not favicon is None: # TODO: raise warning instead
+            favicon = abspath(favicon)
+            if isdir(favicon):
+                favicon = join(favicon, "favicon.svg")
+            if splitext(favicon)[-1].lower() != '.svg':
+                raise Exception("Given image file does not meet requirements")
+            shutil.copy(favicon, join(build, "res/favicon.svg"))
+    except Exception as exception:
+        if not confirm or not confirm( "Unable to import favicon image ({}). "
+                "Do you wish to proceed? [yes/no]".format(exception) ):
+            fail(exception, "Unable to import favicon image")
 
-print("Creating sass scripts and pulling in resources")
-try:
-    os.chdir(os.path.join(PROJECT_DIR, 'dev/sass'))
-    Template.populate(STYLES_SASS_TEMPLATE, 'styles.scss')
-    os.chdir('partials')
-    Template.populate(BASE_PARTIAL_SASS_TEMPLATE, '_base.scss')
-    os.chdir('../modules')
-    Template.populate(BASE_MODULE_SASS_TEMPLATE, '_base.scss')
-except Exception as exception:
-    fatal_exception(exception, "Could not build sass project")
+    try:
+        if not resources is None: # TODO: raise warning instead
+            import_resources(join(build, 'res'), resources, jobs, profiler)
+    except Exception as exception:
+        fail(exception, "Could not import project resources")
 
-try:
-    os.chdir(os.path.join(PROJECT_DIR, 'dev/sass/vendor'))
-    Template.populate(UPDATE_SASS_TEMPLATE, 'update.py')
-    sCall( 'python', 'update.py' ) # wait for update to finish
-    # so that sass can properly be compiled when site is built
-except Exception as exception:
-    fatal_exception(exception, "Could not pull in external sass resources")
+    try: # user may have imported a robots.txt
+        if not isfile(join(build, 'res/static/robots.txt')):
+            populate(ROBOTS_TEMPLATE, 'res/static/robots.txt')
+    except Exception as exception:
+        fail(exception, "Could not create default robots.txt")
 
 
+    step("Generating website in temporary directory")
+    try:
+        populate(BUILD_PY_TEMPLATE, 'build.py',
+                 override_str=OVERRIDES, download_str=DOWNLOADS)
+    except Exception as exception:
+        fail(exception, "Unable to generate website")
 
-print("Creating default views for bottle project")
-try:
-    os.chdir(os.path.join(PROJECT_DIR, 'dev/views'))
-    Template.populate(HEAD_TEMPLATE, '~head.tpl')
-    Template.populate(INDEX_TEMPLATE, 'index.tpl', 
-        title=args.name, 
-        description="Welcome to {}!".format(args.name) )
-except Exception as exception:
-    fatal_exception(exception, "Could not build default views")
-
-
-
-print("Populating project resources")
-try: # TODO: add checking if image doesn't meet requirements
-    os.chdir(os.path.join(PROJECT_DIR, 'res'))
-    if not args.favicon is None: # TODO: raise warning instead
-        if not os.path.isabs(args.favicon):
-            args.favicon = os.path.join(SCRIPT_DIR, args.favicon)
-        if os.path.isdir(args.favicon):
-            args.favicon = os.path.join(args.favicon, "favicon.svg")
-        if os.path.splitext(args.favicon)[-1].lower() != '.svg':
-            raise Exception("Given image file does not meet requirements")
-        shutil.copy(args.favicon, "favicon.svg")
-except Exception as exception:
-    non_fatal_exception(exception, 
-        "Unable to import favicon image. Do you wish to proceed? [yes/no]")
 
-try:
-    os.chdir(os.path.join(PROJECT_DIR, 'res'))
-    if not args.resources is None: # TODO: raise warning instead
-        resources = []
-        for resource_path in args.resources:
-            if not os.path.isabs(resource_path):
-                resource_path = os.path.join(SCRIPT_DIR, resource_path)
-            if os.path.isfile(resource_path):
-                resource.append(resource_path)
-            elif os.path.isdir(resource_path):
-                for root, dirs, files in os.walk(resource_path):
-                    for filename in files:
-                        resources.append(os.path.join(root, filename))
-        for resource in resources: # TODO: could use some improvement
-            name = os.path.split(resource)[-1]
-            ext = os.path.splitext(resource)[-1].lower()
-            if ext == '.svg':
-                font_posibilities = [
-                                        resource[:-4] + '.eot', 
-                                        resource[:-4] + '.ttf', 
-                                        resource[:-4] + '.woff'
-                                    ]
-                if any(res in resources for res in font_posibilities): 
-                    # font file with same name means this one is a font too
-                    shutil.copy(resource, os.path.join('font', name))
-                else:
-                    shutil.copy(resource, os.path.join('img', name))
-            elif ext in ['.png', '.jpg', '.jpeg', '.gif']:
-                shutil.copy(resource, os.path.join('img', name))
-            elif ext in ['.eot', '.ttf', '.woff']:
-                shutil.copy(resource, os.path.join('font', name))
-            else:
-                shutil.copy(resource, os.path.join('static', name))
-except Exception as exception:
-    fatal_exception(exception, "Could not import project resources")
+    step("Moving new project into place")
+    try:
+        retired = "{}.old-{}-{}".format(project, os.getpid(), id(profiler))
+        replace_directory(build, project, retired)
+        if isdir(retired): remove_in_background(retired)
+    except OSError as exception:
+        fail(exception, "Could not replace the existing project")
 
-try:
-    os.chdir(os.path.join(PROJECT_DIR, 'res/static'))
-    if not os.path.isfile('robots.txt'): #user may have imported a robots.txt
-        Template.populate(ROBOTS_TEMPLATE, 'robots.txt')
-except Exception as exception:
-    fatal_exception(exception, "Could not create default robots.txt")
+    if profile: profiler.save(abspath(profile))
+    return project
 
 
 
-print("Generating website in temporary directory")
-try:
-    os.chdir(PROJECT_DIR)
-    Template.populate(BUILD_PY_TEMPLATE, 'build.py',
-                      override_str=OVERRIDES)
-    #sPopen('python', 'build.py', '-d')
-except Exception as exception:
-    fatal_exception(exception, "Unable to generate website")
+if __name__ == "__main__":
+    args = parser.parse_args()
 
+    def confirm(message):
+        while 1:
+            response = input(message)
+            if (RE_USER_ACCEPT.match(response)):
+                return True
+            if (RE_USER_DENY.match(response)):
+                print("Script canceled by user")
+                return False
 
-os.chdir(args.path)
-os.remove("overrides.py")
+    try:
+        create_project( args.name, args.path, args.favicon, args.resources, 
+                        args.jobs, args.profile, confirm )
+    except ProjectError as error:
+        print("*******SCRIPT FAILED*******")
+        print(error)
+        print("Exception: ", error.__cause__)
+        sys.exit(1)